@@ -0,0 +1,15 @@
+"""HTTP-LIFECYCLE-COMPLETE signal handlers."""
+from sanic.models.server_types import ConnInfo  # type: ignore
+
+from app.api.middlewares.on_response import release_request
+
+
+async def release_abandoned_request(conn_info: ConnInfo) -> None:
+    """A "http.lifecycle.complete" signal handler.
+
+    Runs when a connection closes. A client that went away before its response skips the response middlewares,
+    the request it was waiting for is released here.
+    """
+    request = getattr(conn_info.ctx, "request", None)
+    if request is not None:
+        release_request(request)
@@ -1,83 +1,203 @@
 """ON-REQUEST middlewares."""
+import hmac
+import random
 import time
 from sanic import Request  # type: ignore
+from sanic.request import RequestParameters  # type: ignore
 from sanic.response import HTTPResponse, empty  # type: ignore
-from typing import Optional
+from typing import Any, Mapping, Optional
+
+from app.cfg import config
+from app.service.aggregation import MAX_BUCKETS, METRICS, MIN_BUCKET, STATISTICS, parse_choices
+from app.service.metrics import REQUESTS_IN_FLIGHT
+from app.service.models import Aggregate, Geo, Id
+from app.service.profiling import start_profile, start_trace, traced, untraced
+from app.service.pagination import PageRequest, decode_cursor
 
 from app.api.routes.base_view import BaseView  # type: ignore
 
 
+async def track_request(request: Request) -> None:
+    """Counts the request as in flight until it is released, even if the client goes away before the response."""
+    request.ctx.start = time.perf_counter()
+    request.ctx.in_flight = True
+    REQUESTS_IN_FLIGHT.inc()
+    if request.conn_info is not None:
+        # A connection handles one request at a time, closing it releases the request it got no response for
+        request.conn_info.ctx.request = request
+
+
+async def start_profiling(request: Request) -> None:
+    """Traces the request if it is profiled or slow requests are logged, profiles it if asked or sampled."""
+    profiling = config.profiling
+    asked = bool(profiling.token) and hmac.compare_digest(request.headers.get("x-profile", ""), profiling.token)
+    profiled = asked or random.random() < profiling.sample_rate
+    request.ctx.profile = start_profile() if profiled else None
+    if profiled or profiling.slow_request:
+        request.ctx.trace = start_trace(f"{request.method} {request.path}")
+    else:
+        request.ctx.trace = None
+        untraced()
+
+
+@traced("validate_request")
 async def validate_request(request: Request) -> HTTPResponse | None:
-    """Validates request path, query and body parameters of request"""
-    request.ctx.start = time.time()
+    """Validates request path, query and body parameters of request.
 
+    The parsed parameters are put into the request context: query, page and, for aggregates, aggregate,
+    or queries for batches.
+    """
     if not request.route:
         return empty()
-    elif request.route.path == "id":
-        found_error_id: Optional[str] = await validate_id_request(request)
-        if found_error_id:
-            return await BaseView.bad_request(request, found_error_id)
-    elif request.route.path == "geo":
-        found_error_geo: Optional[str] = await validate_geo_request(request)
-        if found_error_geo:
-            return await BaseView.bad_request(request, found_error_geo)
-
-
-async def validate_id_request(request: Request) -> str | None:
-    """Validates request path, query and body parameters of /id request"""
-    if request.args.get("icao") is None:
-        return "'icao' parameter is required"
-    date_error = await validate_date(request)
-    if date_error:
-        return date_error
-
-
-async def validate_geo_request(request: Request) -> str | None:
-    """Validates request path, query and body parameters of /geo request"""
-    lat = request.args.get("lat")
-    lon = request.args.get("lon")
-    radius = request.args.get("radius")
+    path = request.route.path
+    try:
+        if path == "id/batch" and request.method == "POST":
+            request.ctx.queries = parse_batch_request(request.json)
+            return None
+        if path in ("id", "id/aggregate"):
+            request.ctx.query = parse_id_request(request.args)
+        elif path in ("geo", "geo/aggregate"):
+            request.ctx.query = parse_geo_request(request.args)
+        else:
+            return None
+        if path.endswith("aggregate"):
+            request.ctx.aggregate = parse_aggregate(request.args, request.ctx.query.start, request.ctx.query.end)
+        else:
+            request.ctx.page = parse_page(request.args)
+    except ValueError as exc:
+        error = str(exc)
+    else:
+        return None
+    return await BaseView.bad_request(request, error)
+
+
+def parse_id_request(args: RequestParameters) -> Id:
+    """Validates and parses query parameters of /id request, raises ValueError with the error message"""
+    icao = args.get("icao")
+    if icao is None:
+        raise ValueError("'icao' parameter is required")
+    start, end = parse_date(args)
+    return Id(icao, start, end)
+
+
+def parse_batch_request(body: Any) -> tuple[Id, ...]:
+    """Validates and parses the JSON body of /id/batch request, raises ValueError with the error message"""
+    if not isinstance(body, dict):
+        raise ValueError("body must be a JSON object")
+    icaos = body.get("icao")
+    if icaos is None:
+        raise ValueError("'icao' parameter is required")
+    if not isinstance(icaos, list) or not all(isinstance(icao, str) and icao for icao in icaos):
+        raise ValueError("'icao' parameter must be a list of ICAO titles")
+    icaos = list(dict.fromkeys(icaos))
+    if not icaos or len(icaos) > config.max_batch_size:
+        raise ValueError(f"'icao' parameter must list between 1 and {config.max_batch_size} stations")
+    start, end = parse_date(body)
+    return tuple(Id(icao, start, end) for icao in icaos)
+
+
+def parse_geo_request(args: RequestParameters) -> Geo:
+    """Validates and parses query parameters of /geo request, raises ValueError with the error message"""
+    lat = args.get("lat")
+    lon = args.get("lon")
+    radius = args.get("radius")
     if lat is None:
-        return "'lat' parameter is required"
+        raise ValueError("'lat' parameter is required")
     if lon is None:
-        return "'lon' parameter is required"
+        raise ValueError("'lon' parameter is required")
     if radius is None:
-        return "'radius' parameter is required"
+        raise ValueError("'radius' parameter is required")
 
     try:
-        int(radius)
+        radius = int(radius)
     except ValueError:
-        return "'radius' parameter must be int type"
+        raise ValueError("'radius' parameter must be int type")
 
-    if int(radius) < 0:
-        return "'radius' parameter must be greater than 0"
+    if radius < 0:
+        raise ValueError("'radius' parameter must be greater than 0")
 
     try:
-        float(lat)
-        float(lon)
+        lat = float(lat)
+        lon = float(lon)
     except ValueError:
-        return "'lat' and 'lon' parameters must be int or float types"
+        raise ValueError("'lat' and 'lon' parameters must be int or float types")
+
+    if lon >= 180 or lon <= -180:
+        raise ValueError("longitude must be between -180 and 180, inclusive.")
+    if lat <= -90 or lat >= 90:
+        raise ValueError("latitude must be between -90 and 90, inclusive.")
 
-    if float(lon) >= 180 or float(lon) <= -180:
-        return "longitude must be between -180 and 180, inclusive."
-    if float(lat) <= -90 or float(lat) >= 90:
-        return "latitude must be between -90 and 90, inclusive."
+    start, end = parse_date(args)
+    return Geo(lat, lon, radius, start, end)
 
 
-async def validate_date(request: Request) -> str | None:
-    """Validate Date parameters"""
-    start = request.args.get("start")
-    end = request.args.get("end")
+def parse_date(args: Mapping[str, Any]) -> tuple[int, int]:
+    """Validate and parse Date parameters"""
+    start = args.get("start")
+    end = args.get("end")
     if start is None:
-        return "'start' parameter is required"
+        raise ValueError("'start' parameter is required")
     if end is None:
-        return "'end' parameter is required"
+        raise ValueError("'end' parameter is required")
 
     try:
         start = int(start)
         end = int(end)
+    except (TypeError, ValueError):
+        raise ValueError("date parameters must be int type")
+
+    if start < 0 or end < 0:
+        raise ValueError("date parameters must be greater than 0")
+    return start, end
+
+
+def parse_page(args: RequestParameters) -> Optional[PageRequest]:
+    """Validate and parse pagination and output format parameters, None if the rows are not paginated"""
+    limit = args.get("limit")
+    cursor = args.get("cursor")
+    output_format = args.get("format")
+    if output_format is not None and output_format not in ("json", "ndjson"):
+        raise ValueError("'format' parameter must be 'json' or 'ndjson'")
+    if limit is None:
+        if cursor is not None:
+            raise ValueError("'cursor' parameter requires 'limit'")
+        return None
+
+    try:
+        limit = int(limit)
     except ValueError:
-        return "date parameters must be int type"
+        raise ValueError("'limit' parameter must be int type")
+    if limit < 1 or limit > config.max_page_size:
+        raise ValueError(f"'limit' parameter must be between 1 and {config.max_page_size}")
 
-    if int(start) < 0 or int(end) < 0:
-        return "date parameters must be greater than 0"
+    if cursor is None:
+        return PageRequest(limit)
+    try:
+        return PageRequest(limit, decode_cursor(cursor))
+    except ValueError:
+        raise ValueError("'cursor' parameter is malformed")
+
+
+def parse_aggregate(args: RequestParameters, start: int, end: int) -> Aggregate:
+    """Validate and parse bucket and statistics parameters of aggregate requests over start to end"""
+    bucket = args.get("bucket")
+    if bucket is None:
+        raise ValueError("'bucket' parameter is required")
+    try:
+        bucket = int(bucket)
+    except ValueError:
+        raise ValueError("'bucket' parameter must be int type")
+    if bucket < MIN_BUCKET:
+        raise ValueError(f"'bucket' parameter must be at least {MIN_BUCKET} seconds")
+    if end // bucket - start // bucket + 1 > MAX_BUCKETS:
+        raise ValueError(f"'bucket' parameter must split the time range into at most {MAX_BUCKETS} buckets")
+
+    try:
+        metrics = parse_choices(args.get("fields"), METRICS)
+    except ValueError as exc:
+        raise ValueError(f"'fields' parameter {exc}")
+    try:
+        statistics = parse_choices(args.get("stats"), STATISTICS)
+    except ValueError as exc:
+        raise ValueError(f"'stats' parameter {exc}")
+    return Aggregate(bucket, tuple(metrics), tuple(statistics))
@@ -1,11 +1,60 @@
 """ON-RESPONSE middlewares."""
+import os
 import time
 
 from sanic import HTTPResponse, Request  # type: ignore
 from sanic.log import logger  # type: ignore
 
+from app.cfg import config
+from app.service.metrics import REQUEST_SECONDS, REQUESTS_IN_FLIGHT
+from app.service.profiling import save_profile, stop_profile, stop_trace
+
 
 async def send_metrics(request: Request, response: HTTPResponse) -> None:
-    """Sends metrics and fixes headers for CORS on response."""
-    response_time = time.time() - request.ctx.start
-    logger.info(f"{request.method} {request.raw_url.decode('utf-8')} : {response_time} ms")
+    """Records the latency of the request."""
+    start = getattr(request.ctx, "start", None)
+    if start is None:  # the request was answered before its middlewares ran
+        return
+    response_time = time.perf_counter() - start
+    release_request(request)
+    route = f"/{request.route.path}" if request.route else ""
+    REQUEST_SECONDS.labels(route, request.method, str(response.status)).observe(response_time)
+    logger.debug("%s %s : %.2f ms", request.method, request.path, response_time * 1000)
+
+
+def release_request(request: Request) -> None:
+    """Ends the in-flight accounting and the profiling of the request once, whether it was answered or abandoned."""
+    if not getattr(request.ctx, "in_flight", False):
+        return
+    request.ctx.in_flight = False
+    REQUESTS_IN_FLIGHT.dec()
+    if request.conn_info is not None and getattr(request.conn_info.ctx, "request", None) is request:
+        request.conn_info.ctx.request = None
+    # Left by a request abandoned before finish_profiling, the worker could never be profiled again
+    profile = getattr(request.ctx, "profile", None)
+    if profile is not None:
+        request.ctx.profile = None
+        stop_profile(profile)
+    trace = getattr(request.ctx, "trace", None)
+    if trace is not None:
+        request.ctx.trace = None
+        stop_trace(trace)
+
+
+async def finish_profiling(request: Request, response: HTTPResponse) -> None:
+    """Saves the profile of a profiled request, logs the spans of a profiled or slow request."""
+    trace = getattr(request.ctx, "trace", None)
+    if trace is None:
+        return
+    stop_trace(trace)
+    profile = request.ctx.profile
+    request.ctx.trace = request.ctx.profile = None
+    if profile is not None:
+        route = request.route.path.replace("/", "_") if request.route else "unrouted"
+        name = f"{time.time_ns()}-{os.getpid()}-{route}"
+        stats = stop_profile(profile)
+        profiling = config.profiling
+        await request.app.loop.run_in_executor(None, save_profile, profiling.directory, name, stats, profiling.keep)
+        logger.info("Profiled %s %s as %s\n%s", request.method, request.path, name, "\n".join(trace.render()))
+    elif config.profiling.slow_request > 0 and trace.duration >= config.profiling.slow_request:
+        logger.warning("Slow request %s %s\n%s", request.method, request.path, "\n".join(trace.render()))
@@ -2,9 +2,13 @@
 from asyncio import AbstractEventLoop
 
 from sanic import Sanic  # type: ignore
+from sanic.log import logger  # type: ignore
 
 from app.cache.cache import get_cache_instance
+from app.service.rollups import RollupCoverage, load_rollup_coverage, watch_rollup_coverage
+from app.service.spatial import StationIndex, load_station_index, watch_station_catalog
 from app.service.storage_service import StorageService
+from app.storage.indexes import ensure_indexes
 from app.storage.mongo_client import get_db
 
 
@@ -12,11 +16,37 @@ async def create_app_context(app: Sanic, loop: AbstractEventLoop) -> None:
     """A "BEFORE_SERVER_START" listener.
 
     On the application start creates database client, service and puts them into application context.
+    Runs in every worker, which only accepts requests once its pools, station index and local cache are warm.
     """
     storage_icao = get_db(app.ctx.config.mongo.collection_icao)
     storage_weather_data = get_db(app.ctx.config.mongo.collection_weather_data)
+    await ensure_indexes(storage_icao, storage_weather_data)
     cache = get_cache_instance()
-    storage_service_icao = StorageService(storage=storage_icao, cache=cache)
-    storage_service_weather_data = StorageService(storage=storage_weather_data, cache=cache)
-    app.ext.dependency(storage_service_icao)
+    app.ctx.cache = cache
+    preloaded = await cache.preload(app.ctx.config.redis.prewarm)
+    logger.info(f"Local cache preloaded with {preloaded} reports")
+    app.add_task(cache.watch_invalidations(), name="watch_cache_invalidations")
+    app.add_task(cache.watch_popularity(app.ctx.config.redis.popularity_flush), name="watch_cache_popularity")
+    storage_meta = get_db(app.ctx.config.mongo.collection_meta)
+    stations = StationIndex()
+    await load_station_index(stations, storage_icao, storage_meta)
+    app.add_task(
+        watch_station_catalog(stations, storage_icao, storage_meta, app.ctx.config.station_index_refresh),
+        name="watch_station_catalog",
+    )
+    coverage = RollupCoverage()
+    await load_rollup_coverage(coverage, storage_meta)
+    app.add_task(
+        watch_rollup_coverage(coverage, storage_meta, app.ctx.config.rollup_coverage_refresh),
+        name="watch_rollup_coverage",
+    )
+    storage_service_weather_data = StorageService(
+        storage=storage_weather_data,
+        cache=cache,
+        stations=stations,
+        rollups=app.ctx.config.mongo.rollups,
+        coverage=coverage,
+        cache_window=app.ctx.config.redis.window,
+        fill_wait=app.ctx.config.redis.fill_wait,
+    )
     app.ext.dependency(storage_service_weather_data)
@@ -0,0 +1,15 @@
+"""ON-STOP listeners."""
+from asyncio import AbstractEventLoop
+
+from sanic import Sanic  # type: ignore
+
+from app.storage.mongo_client import close_mongo_clients
+
+
+async def close_app_context(app: Sanic, loop: AbstractEventLoop) -> None:
+    """An "AFTER_SERVER_STOP" listener.
+
+    On the application stop closes the database connection pool and the cache client.
+    """
+    close_mongo_clients()
+    await app.ctx.cache.redis_client.close()
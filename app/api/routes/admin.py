@@ -0,0 +1,47 @@
+"""Admin routes."""
+import hmac
+import os
+
+from sanic import HTTPResponse, Request  # type: ignore
+from sanic.response import file  # type: ignore
+from sanic_ext import openapi  # type: ignore
+
+from app.api.routes.base_view import BaseView
+from app.cfg import config
+from app.service.profiling import list_profiles
+
+
+def is_admin(request: Request) -> bool:
+    """Whether the X-Admin-Token header holds the profiling token, never when no token is configured."""
+    token = config.profiling.token
+    return bool(token) and hmac.compare_digest(request.headers.get("x-admin-token", ""), token)
+
+
+class ProfilesRoute(BaseView):
+    """View of the saved cProfile dumps of profiled requests."""
+
+    @openapi.tag("Admin")
+    @openapi.response(200, [str], description="Dump names, newest first")
+    @openapi.parameter(name="X-Admin-Token", location="header", required=True, schema=str)
+    async def get(self, request: Request) -> HTTPResponse:
+        """List the cProfile dumps of every worker."""
+        if not is_admin(request):
+            return await self.not_found(request)
+        return await self.ok_response(request, list_profiles(config.profiling.directory))
+
+
+class ProfileRoute(BaseView):
+    """View of one cProfile dump."""
+
+    @openapi.tag("Admin")
+    @openapi.response(200, bytes, description="cProfile dump, for pstats, snakeviz or flameprof")
+    @openapi.parameter(name="X-Admin-Token", location="header", required=True, schema=str)
+    async def get(self, request: Request, name: str) -> HTTPResponse:
+        """Download a cProfile dump."""
+        if not is_admin(request) or name not in list_profiles(config.profiling.directory):
+            return await self.not_found(request)
+        path = os.path.join(config.profiling.directory, name)
+        try:
+            return await file(path, mime_type="application/octet-stream", filename=name)
+        except FileNotFoundError:  # pruned by a worker since listed
+            return await self.not_found(request)
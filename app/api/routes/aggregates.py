@@ -0,0 +1,114 @@
+"""Aggregate requests."""
+from sanic import HTTPResponse, Request  # type: ignore
+from sanic_ext import openapi  # type: ignore
+
+from app.api.routes.base_view import BaseView
+from app.api.schemas import AggregateSchema, Schema20x40x, Schema5xx
+from app.service.storage_service import StorageService
+
+
+class IDAggregate(BaseView):
+    """View of bucketed statistics of one station."""
+
+    @openapi.response(200, [AggregateSchema], description="OK")
+    @openapi.response(400, Schema20x40x, description="Bad Request")
+    @openapi.response(500, Schema5xx, description="Internal Server Error")
+    @openapi.parameter(
+        name="stats",
+        description="comma-separated statistics: min, max, mean, count (default: all)",
+        location="query",
+        required=False,
+        schema=str,
+    )
+    @openapi.parameter(
+        name="fields",
+        description="comma-separated metrics: temperature, pressure, wind_speed (default: all)",
+        location="query",
+        required=False,
+        schema=str,
+    )
+    @openapi.parameter(
+        name="bucket", description="bucket size, in seconds", location="query", required=True, schema=int
+    )
+    @openapi.parameter(
+        name="end", description="end unix timestamp", location="query", required=True, allowEmptyValue=False, schema=int
+    )
+    @openapi.parameter(
+        name="start",
+        description="start unix timestamp",
+        location="query",
+        required=True,
+        allowEmptyValue=False,
+        schema=int,
+    )
+    @openapi.parameter(
+        name="icao", description="ICAO title", location="query", required=True, allowEmptyValue=False, schema=str
+    )
+    async def get(self, request: Request, storage: StorageService) -> HTTPResponse:
+        """Get min/max/mean/count of station metrics per time bucket."""
+        buckets = await storage.id_aggregate(request.ctx.query, request.ctx.aggregate)
+        return self.rows_response(buckets)
+
+
+class GeoAggregate(BaseView):
+    """View of bucketed statistics of stations within a radius."""
+
+    @openapi.response(200, [AggregateSchema], description="OK")
+    @openapi.response(400, Schema20x40x, description="Bad Request")
+    @openapi.response(500, Schema5xx, description="Internal Server Error")
+    @openapi.parameter(
+        name="stats",
+        description="comma-separated statistics: min, max, mean, count (default: all)",
+        location="query",
+        required=False,
+        schema=str,
+    )
+    @openapi.parameter(
+        name="fields",
+        description="comma-separated metrics: temperature, pressure, wind_speed (default: all)",
+        location="query",
+        required=False,
+        schema=str,
+    )
+    @openapi.parameter(
+        name="bucket", description="bucket size, in seconds", location="query", required=True, schema=int
+    )
+    @openapi.parameter(
+        name="end", description="end unix timestamp", location="query", required=True, allowEmptyValue=False, schema=int
+    )
+    @openapi.parameter(
+        name="start",
+        description="start unix timestamp",
+        location="query",
+        required=True,
+        allowEmptyValue=False,
+        schema=int,
+    )
+    @openapi.parameter(
+        name="radius",
+        description="radius, in meters",
+        location="query",
+        required=True,
+        allowEmptyValue=False,
+        schema=int,
+    )
+    @openapi.parameter(
+        name="lon",
+        description="longitude, decimal format",
+        location="query",
+        required=True,
+        allowEmptyValue=False,
+        schema=float,
+    )
+    @openapi.parameter(
+        name="lat",
+        description="latitude, decimal format",
+        location="query",
+        required=True,
+        allowEmptyValue=False,
+        schema=float,
+    )
+    async def get(self, request: Request, storage: StorageService) -> HTTPResponse:
+        """Get min/max/mean/count of metrics of every station within the radius per time bucket."""
+        buckets = await storage.geo_aggregate(request.ctx.query, request.ctx.aggregate)
+        return self.rows_response(buckets)
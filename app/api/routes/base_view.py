@@ -1,12 +1,16 @@
 """Abstract interfaces module."""
-from typing import Any, Iterable, Optional, Union
+import time
+from typing import Any, AsyncIterator, Iterable, Optional, Union
 
 from sanic import HTTPResponse, Request, json  # type: ignore
 from sanic.log import logger  # type: ignore
-from sanic.response import empty  # type: ignore
+from sanic.response import empty, json_dumps, raw  # type: ignore
 from sanic.views import HTTPMethodView  # type: ignore
 from sanic_ext import openapi  # type: ignore
 
+from app.service.metrics import SERIALIZE_SECONDS
+from app.service.profiling import span
+
 
 class BaseView(HTTPMethodView):
     """Base class-based view providing all HTTP-methods."""
@@ -21,6 +25,45 @@ class BaseView(HTTPMethodView):
             return json({"code": code, "message": response}, status=code)
         return json(response, code)
 
+    @classmethod
+    def rows_response(
+        cls, rows: Union[list[dict], dict[str, list[dict]]], next_cursor: Optional[str] = None
+    ) -> HTTPResponse:
+        """Return OK with rows serialized straight into the response body and the next page token in a header."""
+        headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+        started = time.perf_counter()
+        with span("serialize"):
+            body = json_dumps(rows)
+        SERIALIZE_SECONDS.observe(time.perf_counter() - started)
+        return raw(body, content_type="application/json", headers=headers)
+
+    @staticmethod
+    def wants_ndjson(request: Request) -> bool:
+        """Whether the client asked for newline-delimited JSON."""
+        return request.args.get("format") == "ndjson" or "application/x-ndjson" in request.headers.get("accept", "")
+
+    @classmethod
+    async def stream_rows(cls, request: Request, rows: AsyncIterator[dict], chunk_size: int = 500) -> None:
+        """Stream rows as newline-delimited JSON while they are read, chunk_size rows per write."""
+        response = await request.respond(content_type="application/x-ndjson")
+        serializing = 0.0
+        chunk = []
+        async for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                started = time.perf_counter()
+                body = "".join(json_dumps(row) + "\n" for row in chunk)
+                serializing += time.perf_counter() - started
+                await response.send(body)
+                chunk = []
+        if chunk:
+            started = time.perf_counter()
+            body = "".join(json_dumps(row) + "\n" for row in chunk)
+            serializing += time.perf_counter() - started
+            await response.send(body)
+        SERIALIZE_SECONDS.observe(serializing)
+        await response.eof()
+
     @classmethod
     async def bad_request(cls, request: Request, exception: Optional[str] = None) -> HTTPResponse:
         """Return 400 "Bad Request" and message."""
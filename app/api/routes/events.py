@@ -1,11 +1,12 @@
 """ID requests."""
 # import dataclasses
+from typing import Optional
 
-from sanic import HTTPResponse, Request, json  # type: ignore
+from sanic import HTTPResponse, Request  # type: ignore
 from sanic_ext import openapi  # type: ignore
 
 from app.api.routes.base_view import BaseView
-from app.api.schemas import IdSchema, GeoSchema, Schema20x40x, Schema5xx
+from app.api.schemas import BatchSchema, IdSchema, GeoSchema, Schema20x40x, Schema5xx
 from app.service.storage_service import StorageService
 
 
@@ -16,6 +17,23 @@ class IDEvents(BaseView):
     @openapi.response(400, Schema20x40x, description="Bad Request")
     @openapi.response(404, Schema20x40x, description="Not Found")
     @openapi.response(500, Schema5xx, description="Internal Server Error")
+    @openapi.parameter(
+        name="format",
+        description="'ndjson' streams rows as newline-delimited JSON",
+        location="query",
+        required=False,
+        schema=str,
+    )
+    @openapi.parameter(
+        name="cursor",
+        description="continuation token from the X-Next-Cursor header of the previous page",
+        location="query",
+        required=False,
+        schema=str,
+    )
+    @openapi.parameter(
+        name="limit", description="page size, enables pagination", location="query", required=False, schema=int
+    )
     @openapi.parameter(
         name="end", description="end unix timestamp", location="query", required=True, allowEmptyValue=False, schema=int
     )
@@ -30,19 +48,30 @@ class IDEvents(BaseView):
     @openapi.parameter(
         name="icao", description="ICAO title", location="query", required=True, allowEmptyValue=False, schema=str
     )
-    async def get(self, request: Request, storage: StorageService) -> HTTPResponse:
+    async def get(self, request: Request, storage: StorageService) -> Optional[HTTPResponse]:
         """Get all events for a given trigger ID."""
-        icao = request.args.get("icao")
-        start = request.args.get("start")
-        end = request.args.get("end")
-        if icao is None:
-            return await self.bad_request(request, "icao is required")
-        if start is None:
-            return await self.bad_request(request, "start time is required")
-        if end is None:
-            return await self.bad_request(request, "end time is required")
-        icao_data = await storage.id_query(request.args)
-        return json(icao_data)
+        query = request.ctx.query
+        if self.wants_ndjson(request):
+            await self.stream_rows(request, storage.iter_id_query(query))
+            return None
+        if request.ctx.page is not None:
+            page = await storage.id_query_page(query, request.ctx.page)
+            return self.rows_response(page.rows, page.next_cursor)
+        icao_data = await storage.id_query(query)
+        return self.rows_response(icao_data)
+
+
+class IDBatchEvents(BaseView):
+    """View of operations on ID events of many stations."""
+
+    @openapi.body({"application/json": BatchSchema}, description="ICAO titles and unix timestamps", required=True)
+    @openapi.response(200, {"application/json": {str: [IdSchema]}}, description="OK, events by ICAO title")
+    @openapi.response(400, Schema20x40x, description="Bad Request")
+    @openapi.response(500, Schema5xx, description="Internal Server Error")
+    async def post(self, request: Request, storage: StorageService) -> HTTPResponse:
+        """Get all events of many stations within one time range, grouped by station."""
+        reports = await storage.id_batch(request.ctx.queries)
+        return self.rows_response(reports)
 
 
 class GeoEvents(BaseView):
@@ -60,6 +89,23 @@ class GeoEvents(BaseView):
         allowEmptyValue=False,
         schema=int,
     )
+    @openapi.parameter(
+        name="format",
+        description="'ndjson' streams rows as newline-delimited JSON",
+        location="query",
+        required=False,
+        schema=str,
+    )
+    @openapi.parameter(
+        name="cursor",
+        description="continuation token from the X-Next-Cursor header of the previous page",
+        location="query",
+        required=False,
+        schema=str,
+    )
+    @openapi.parameter(
+        name="limit", description="page size, enables pagination", location="query", required=False, schema=int
+    )
     @openapi.parameter(
         name="end", description="end unix timestamp", location="query", required=True, allowEmptyValue=False, schema=int
     )
@@ -87,23 +133,14 @@ class GeoEvents(BaseView):
         allowEmptyValue=False,
         schema=float,
     )
-    async def get(self, request: Request, storage: StorageService) -> HTTPResponse:
+    async def get(self, request: Request, storage: StorageService) -> Optional[HTTPResponse]:
         """Get all events for a given trigger ID."""
-        lat = request.args.get("lat")
-        lon = request.args.get("lon")
-        radius = request.args.get("radius")
-        start = request.args.get("start")
-        end = request.args.get("end")
-        if lat is None:
-            return await self.bad_request(request, "latitude is required")
-        if lon is None:
-            return await self.bad_request(request, "longitude is required")
-        if radius is None:
-            return await self.bad_request(request, "radius is required")
-        if start is None:
-            return await self.bad_request(request, "start time is required")
-        if end is None:
-            return await self.bad_request(request, "end time is required")
-
-        icao_data = await storage.geo_query(request.args)
-        return json(icao_data)
+        query = request.ctx.query
+        if self.wants_ndjson(request):
+            await self.stream_rows(request, storage.iter_geo_query(query))
+            return None
+        if request.ctx.page is not None:
+            page = await storage.geo_query_page(query, request.ctx.page)
+            return self.rows_response(page.rows, page.next_cursor)
+        icao_data = await storage.geo_query(query)
+        return self.rows_response(icao_data)
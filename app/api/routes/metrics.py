@@ -0,0 +1,20 @@
+"""Metrics route module."""
+
+from sanic import HTTPResponse, Request  # type: ignore
+from sanic.response import text  # type: ignore
+from sanic_ext import openapi  # type: ignore
+
+from app.api.routes.base_view import BaseView
+from app.service.metrics import registry
+
+
+class MetricsRoute(BaseView):
+    """
+    Metrics of the worker process that handles the request, in the Prometheus text format.
+    """
+
+    @openapi.tag("Metrics")
+    @openapi.response(200, str, description="Prometheus text exposition format.")
+    async def get(self, request: Request) -> HTTPResponse:
+        """Return the metrics of the worker."""
+        return text(registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -29,3 +29,21 @@ class IdSchema(StorageService):
 @dataclass()
 class GeoSchema(StorageService):
     pass
+
+
+@dataclass()
+class BatchSchema:
+    """Schema of /id/batch request bodies."""
+
+    icao: list[str]
+    start: int
+    end: int
+
+
+@dataclass()
+class AggregateSchema:
+    """Schema of one station bucket of aggregate responses, with the requested statistics of every metric."""
+
+    icao: str
+    bucket: int
+    count: int
@@ -1,53 +1,356 @@
 from abc import ABC
+import asyncio
+import logging
+import secrets
+import time
+from collections import Counter, defaultdict
 
-from app.service.cache import CacheWrapper, CacheMiss
+from app.cache.local import LocalCache, rows_size
+from app.service.metrics import CACHE_REQUESTS
+from app.service.profiling import traced
+from app.service.rollups import live_since
+from app.service.cache import CacheWrapper, CacheMiss, CacheStale
+from app.service.models import Geo, Id, Query
 
 from redis import asyncio as aioredis
 from app.cfg import config
 
-from typing import Dict
-import json
+from typing import Any, Dict, Iterable, Optional, TypeVar
+import hashlib
+
+import ujson  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+Q = TypeVar("Q", Id, Geo)
+
+# Deletes a lease only while it still holds the token of the caller, an expired lease may belong to someone else
+_RELEASE_LEASE = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+def query_member(kind: str, params: Dict[str, Any]) -> str:
+    """Canonical form of a query, the same for any order or spelling of the same parameters"""
+    return ujson.dumps({"kind": kind, **params}, sort_keys=True, ensure_ascii=True)
+
+
+def member_key(kind: str, member: str) -> str:
+    """Namespaced cache key of a canonical query of kind"""
+    digest = hashlib.blake2b(member.encode("utf-8"), digest_size=16).hexdigest()
+    return f"{config.redis.namespace}:{kind}:{digest}"
+
+
+def id_member(query: Id) -> str:
+    return query_member("id", {"icao": query.icao, "start": query.start, "end": query.end})
+
+
+def geo_member(query: Geo) -> str:
+    return query_member(
+        "geo",
+        {
+            "lat": round(query.lat, 2),
+            "lon": round(query.lon, 2),
+            "radius": query.radius,
+            "start": query.start,
+            "end": query.end,
+        },
+    )
+
+
+def to_member(query: Query) -> str:
+    return id_member(query) if isinstance(query, Id) else geo_member(query)
+
+
+def query_kind(query: Query) -> str:
+    return "id" if isinstance(query, Id) else "geo"
+
+
+def member_query(member: str) -> Query:
+    """Query of a canonical query"""
+    params = ujson.loads(member)
+    return Id(**params) if params.pop("kind") == "id" else Geo(**params)
 
 
 class EventsCache(CacheWrapper, ABC):
+    """Query results in a per-worker LocalCache in front of Redis.
+
+    Every cached query that may still get new reports is indexed in a sorted set per station, scored by the end of
+    its time range. The ingest invalidates the queries of the stations it stored reports for, and publishes their
+    keys so that workers drop them from the local tier. Redis keeps a report for stale_ttl seconds after it
+    expires, so that it can be served while refreshed.
+    """
+
     def __init__(self) -> None:
         self.redis_client: aioredis.Redis = aioredis.Redis(host=config.redis.host, port=int(config.redis.port), db=0)
+        self.local = LocalCache(config.redis.local_bytes, config.redis.local_ttl)
+        self.channel = f"{config.redis.namespace}:invalidate"
+        self.popular_key = f"{config.redis.namespace}:popular"
+        self.popularity: Counter[str] = Counter()
 
-    async def get_geo_query(self, icao: dict) -> list[Dict]:
-        """Check if geo query exist in cache"""
-        icao["lat"] = round(float(*icao["lat"]), 2)
-        icao["lon"] = round(float(*icao["lon"]), 2)
-        icao_encode = json.dumps(icao).encode("utf-8")
-        cache = await self.redis_client.get(icao_encode)
-        if cache:
-            cache_decoded = json.loads(cache)
-            return cache_decoded
-        else:
+    def _count(self, tier: str, hit: bool) -> None:
+        CACHE_REQUESTS.labels(tier, "hit" if hit else "miss").inc()
+
+    def _station_key(self, icao: str) -> str:
+        return f"{config.redis.namespace}:station:{icao}"
+
+    def _ttl(self, report: list[Dict], end: int) -> int:
+        """Seconds a report stays fresh: empty reports briefly, reports that can no longer change the longest"""
+        if not report:
+            return config.redis.empty_ttl
+        if end < live_since():
+            return config.redis.historic_ttl
+        return config.redis.ttl
+
+    @traced("EventsCache.get")
+    async def _get(self, query: Query) -> list[Dict]:
+        member = to_member(query)
+        self.popularity[member] += 1
+        key = member_key(query_kind(query), member)
+        report = self.local.get(key)
+        self._count("local", report is not None)
+        if report is not None:
+            return report
+        cache = await self.redis_client.get(key)
+        self._count("redis", bool(cache))
+        if not cache:
             raise CacheMiss
+        fresh_until, report = ujson.loads(cache)
+        remaining = fresh_until - time.time()
+        if remaining <= 0:
+            raise CacheStale(report)
+        self.local.set(key, report, rows_size(report), remaining)
+        return report
+
+    async def peek_query(self, query: Query) -> Optional[list[Dict]]:
+        """Fresh report of an id or geo query in Redis, None if there is none.
+
+        Unlike a get, the lookup counts neither as a cache request nor towards the popularity of the query.
+        """
+        key = self.query_key(query)
+        cache = await self.redis_client.get(key)
+        if not cache:
+            return None
+        fresh_until, report = ujson.loads(cache)
+        remaining = fresh_until - time.time()
+        if remaining <= 0:
+            return None
+        self.local.set(key, report, rows_size(report), remaining)
+        return report
+
+    @traced("EventsCache.get_many")
+    async def _get_many(self, queries: Iterable[Q]) -> Dict[Q, list[Dict]]:
+        """Fresh reports of the queries, those missing from the local tier are read with one MGET.
+
+        Queries without a fresh report are left out, a stale report is reloaded rather than served.
+        """
+        found = {}
+        remote = []
+        for query in queries:
+            member = to_member(query)
+            self.popularity[member] += 1
+            key = member_key(query_kind(query), member)
+            report = self.local.get(key)
+            self._count("local", report is not None)
+            if report is None:
+                remote.append((query, key))
+            else:
+                found[query] = report
+        if not remote:
+            return found
+        caches = await self.redis_client.mget([key for _, key in remote])
+        now = time.time()
+        for (query, key), cache in zip(remote, caches):
+            self._count("redis", bool(cache))
+            if not cache:
+                continue
+            fresh_until, report = ujson.loads(cache)
+            if fresh_until > now:
+                self.local.set(key, report, rows_size(report), fresh_until - now)
+                found[query] = report
+        return found
+
+    async def _set(self, query: Query, report: list[Dict], stations: Optional[Iterable[str]]) -> None:
+        """Cache a report, indexed by the stations whose new reports would change it"""
+        await self._set_many([(query, report, stations)])
+
+    @traced("EventsCache.set")
+    async def _set_many(self, entries: list[tuple[Query, list[Dict], Optional[Iterable[str]]]]) -> None:
+        """Cache reports with one pipeline, each entry is a query, its report and its stations"""
+        since = live_since()
+        cached = []
+        indexed: Dict[str, Dict[str, int]] = defaultdict(dict)
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            for query, report, stations in entries:
+                member = to_member(query)
+                key = member_key(query_kind(query), member)
+                end = query.end
+                ttl = self._ttl(report, end)
+                encoded = ujson.dumps([time.time() + ttl, report]).encode("utf-8")
+                pipe.set(key, encoded, ex=ttl + config.redis.stale_ttl)
+                if end >= since:
+                    # Without the stations the query is invalidated by the reports of any station
+                    for station in stations if stations is not None else ["*"]:
+                        indexed[station][member] = end
+                cached.append((key, report, ttl))
+            # One write per station however many queries of the batch cover it, invalidate trims settled members
+            for station, members in indexed.items():
+                station_key = self._station_key(station)
+                pipe.zadd(station_key, members)
+                pipe.expire(station_key, config.redis.ttl + config.redis.stale_ttl)
+            await pipe.execute()
+        for key, report, ttl in cached:
+            self.local.set(key, report, rows_size(report), ttl)
+
+    def query_key(self, query: Query) -> str:
+        """Cache key of an id or geo query"""
+        return member_key(query_kind(query), to_member(query))
+
+    @traced("EventsCache.acquire_lease")
+    async def acquire_lease(self, key: str) -> Optional[str]:
+        """Take the lease to refill key across workers, returns its token or None if another caller holds it"""
+        token = secrets.token_hex(8)
+        acquired = await self.redis_client.set(
+            f"{key}:lease", token, nx=True, px=int(config.redis.lease_timeout * 1000)
+        )
+        return token if acquired else None
+
+    async def release_lease(self, key: str, token: str) -> None:
+        await self.redis_client.eval(_RELEASE_LEASE, 1, f"{key}:lease", token)
+
+    async def invalidate(self, changes: Dict[str, tuple[int, int]]) -> list[Query]:
+        """Drop the cached queries that new reports of the stations change, in Redis and in every worker.
+
+        changes maps stations to the first and last date of their new reports, returns the dropped queries.
+        """
+        if not changes:
+            return []
+        station_keys = [self._station_key(icao) for icao in changes] + [self._station_key("*")]
+        since = [first for first, _ in changes.values()]
+        since.append(min(since))
+        settled = live_since() - 1
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            for station_key, first in zip(station_keys, since):
+                pipe.zremrangebyscore(station_key, "-inf", settled)
+                pipe.zrangebyscore(station_key, first, "+inf")
+            found = (await pipe.execute())[1::2]
+        members = sorted({member.decode("utf-8") for station_members in found for member in station_members})
+        if not members:
+            return []
+        queries = [member_query(member) for member in members]
+        keys = [member_key(query_kind(query), member) for query, member in zip(queries, members)]
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            pipe.delete(*keys)
+            for station_key, station_members in zip(station_keys, found):
+                if station_members:
+                    pipe.zrem(station_key, *station_members)
+            pipe.publish(self.channel, ujson.dumps(keys))
+            await pipe.execute()
+        return queries
 
-    async def get_id_query(self, icao: dict) -> list[Dict]:
+    async def watch_invalidations(self) -> None:
+        """Drop invalidated keys from the local tier, resubscribing after connection errors"""
+        while True:
+            try:
+                async with self.redis_client.pubsub() as pubsub:
+                    await pubsub.subscribe(self.channel)
+                    # Messages published while unsubscribed are lost, start over from an empty tier
+                    self.local.clear()
+                    async for message in pubsub.listen():
+                        if message["type"] == "message":
+                            for key in ujson.loads(message["data"]):
+                                self.local.pop(key)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Cache invalidation subscription failed")
+                await asyncio.sleep(1)
+
+    async def flush_popularity(self) -> None:
+        """Add the query counts of the worker to the shared ranking, which keeps the popular_size top queries.
+
+        Every popularity_decay seconds, the first worker to flush halves every score, so that the ranking follows the
+        queries requested lately.
+        """
+        counts, self.popularity = self.popularity, Counter()
+        if not counts:
+            return
+        decay = config.redis.popularity_decay > 0 and await self.redis_client.set(
+            f"{self.popular_key}:decayed", 1, nx=True, ex=max(1, int(config.redis.popularity_decay))
+        )
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            if decay:
+                pipe.zunionstore(self.popular_key, {self.popular_key: 0.5})
+            for member, count in counts.items():
+                pipe.zincrby(self.popular_key, count, member)
+            pipe.zremrangebyrank(self.popular_key, 0, -config.redis.popular_size - 1)
+            pipe.expire(self.popular_key, config.redis.historic_ttl)
+            await pipe.execute()
+
+    async def watch_popularity(self, interval: float) -> None:
+        """Flush the query counts of the worker every interval seconds"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.flush_popularity()
+            except Exception:
+                logger.exception("Cache popularity flush failed")
+
+    async def most_popular(self, queries: list[Query], limit: int) -> list[Query]:
+        """Up to limit of the queries that were requested the most"""
+        if not queries or limit <= 0:
+            return []
+        members = [to_member(query) for query in queries]
+        scores = await self.redis_client.zmscore(self.popular_key, members)
+        ranked = sorted(((score, query) for score, query in zip(scores, queries) if score), key=lambda item: -item[0])
+        return [query for _, query in ranked[:limit]]
+
+    async def preload(self, limit: int) -> int:
+        """Load the most popular fresh reports from Redis into the local tier, returns the number loaded"""
+        if limit <= 0:
+            return 0
+        members = await self.redis_client.zrevrange(self.popular_key, 0, limit - 1)
+        if not members:
+            return 0
+        decoded = [member.decode("utf-8") for member in members]
+        keys = [member_key(query_kind(member_query(member)), member) for member in decoded]
+        loaded = 0
+        for key, cache in zip(keys, await self.redis_client.mget(keys)):
+            if not cache:
+                continue
+            fresh_until, report = ujson.loads(cache)
+            remaining = fresh_until - time.time()
+            if remaining > 0:
+                self.local.set(key, report, rows_size(report), remaining)
+                loaded += 1
+        return loaded
+
+    async def get_geo_query(self, query: Geo) -> list[Dict]:
+        """Check if geo query exist in cache"""
+        return await self._get(query)
+
+    async def get_id_query(self, query: Id) -> list[Dict]:
         """Check if id query exist in cache"""
-        icao_encode = json.dumps(icao).encode("utf-8")
-        cache = await self.redis_client.get(icao_encode)
-        if cache:
-            cache_decoded = json.loads(cache)
-            return cache_decoded
-        else:
-            raise CacheMiss
+        return await self._get(query)
 
-    async def set_geo_query(self, icao: dict, report: list[Dict]) -> None:
-        """Save geo query in cache"""
-        icao["lat"] = round(float(*icao["lat"]), 2)
-        icao["lon"] = round(float(*icao["lon"]), 2)
-        icao_encode = json.dumps(icao).encode("utf-8")
-        report_encode = json.dumps(report).encode("utf-8")
-        await self.redis_client.set(icao_encode, report_encode, ex=1700)
+    async def set_geo_query(self, query: Geo, report: list[Dict], stations: Optional[list[str]] = None) -> None:
+        """Save geo query in cache, stations are the stations within the radius when known"""
+        await self._set(query, report, stations)
 
-    async def set_id_query(self, icao: dict, report: list[Dict]) -> None:
+    async def set_id_query(self, query: Id, report: list[Dict]) -> None:
         """Save id query in cache"""
-        icao_encode = json.dumps(icao).encode("utf-8")
-        report_encode = json.dumps(report).encode("utf-8")
-        await self.redis_client.set(icao_encode, report_encode, ex=1700)
+        await self._set(query, report, [query.icao])
+
+    async def get_id_queries(self, queries: list[Id]) -> Dict[Id, list[Dict]]:
+        """Fresh cached reports of many id queries, the queries without one are left out"""
+        return await self._get_many(queries)
+
+    async def set_id_queries(self, reports: Dict[Id, list[Dict]]) -> None:
+        """Save many id queries in cache"""
+        await self._set_many([(query, report, [query.icao]) for query, report in reports.items()])
 
 
 def get_cache_instance() -> EventsCache:
@@ -0,0 +1,71 @@
+"""In-process LRU/TTL cache tier."""
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+
+def _deep_size(value: Any) -> int:
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(_deep_size(key) + _deep_size(item) for key, item in value.items())
+    elif isinstance(value, list):
+        size += sum(_deep_size(item) for item in value)
+    return size
+
+
+def rows_size(rows: list) -> int:
+    """Approximate memory of decoded rows, every row is assumed to be the size of the first one"""
+    if not rows:
+        return sys.getsizeof(rows)
+    return sys.getsizeof(rows) + len(rows) * _deep_size(rows[0])
+
+
+class LocalCache(object):
+    """Decoded query results of one worker, evicted least recently used first when over max_bytes.
+
+    Entries are shared between requests and must be treated as read-only.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float) -> None:
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self._entries: OrderedDict[str, tuple[float, int, Any]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[Any]:
+        """Get a live entry and mark it recently used, None if there is none"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, size, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.size -= size
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, size: int, ttl: Optional[float] = None) -> None:
+        """Store value of about size bytes for at most ttl seconds, entries larger than the budget are not stored"""
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if self.max_bytes <= 0 or ttl <= 0 or size > self.max_bytes:
+            return
+        self.pop(key)
+        self._entries[key] = (time.monotonic() + ttl, size, value)
+        self.size += size
+        while self.size > self.max_bytes:
+            _, (_, evicted, _) = self._entries.popitem(last=False)
+            self.size -= evicted
+
+    def pop(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.size = 0
@@ -4,6 +4,7 @@ import asyncio
 import logging
 import os
 import sys
+import tempfile
 
 import uvloop  # type: ignore
 
@@ -25,6 +26,13 @@ class Config:
         self.loglevel: str = log_level
         self.mongo = self._MongoMeta()
         self.redis = self.Cache()
+        self.collector = self._Collector()
+        self.server = self._Server()
+        self.profiling = self._Profiling()
+        self.max_page_size = int(os.getenv("MAX_PAGE_SIZE", 10000))
+        self.max_batch_size = int(os.getenv("MAX_BATCH_SIZE", 500))  # stations of one /id/batch request
+        self.station_index_refresh = float(os.getenv("STATION_INDEX_REFRESH", 300))  # seconds
+        self.rollup_coverage_refresh = float(os.getenv("ROLLUP_COVERAGE_REFRESH", 60))  # seconds
         self.logging_config = dict(
             version=1,
             disable_existing_loggers=False,
@@ -78,7 +86,7 @@ class Config:
     class APIConfig:
         """Sanic configuration."""
 
-        DEBUG = True if log_level == "DEBUG" else False
+        DEBUG = bool(int(os.getenv("DEBUG", 0)))
         ACCESS_LOG = bool(int(os.getenv("ACCESS_LOG", 1)))
         REQUEST_TIMEOUT = int(os.getenv("REQUEST_TIMEOUT", 5))
         RESPONSE_TIMEOUT = int(os.getenv("RESPONSE_TIMEOUT", 5))
@@ -98,10 +106,28 @@ class Config:
             self.db: str = os.getenv("MONGO_DATABASE", "icao")
             self.collection_icao = os.getenv("COLLECTION", "icao")
             self.collection_weather_data = os.getenv("COLLECTION", "weather_data")
+            self.collection_meta = os.getenv("COLLECTION_META", "meta")
+            self.collection_watermarks = os.getenv("COLLECTION_WATERMARKS", "watermarks")
+            # rollup granularity in seconds -> collection of pre-aggregated partial statistics
+            self.rollups = {
+                3600: os.getenv("COLLECTION_HOURLY", "weather_hourly"),
+                86400: os.getenv("COLLECTION_DAILY", "weather_daily"),
+            }
+            self.batch_size = int(os.getenv("MONGO_BATCH_SIZE", 1000))
+            self.observations_ttl = int(os.getenv("OBSERVATIONS_TTL", 0))  # seconds, 0 keeps observations forever
 
             uri = f"mongodb://{self._host}:{self._port}/{self.db}"
 
             self.uri = os.getenv("MONGO_URI", uri)
+            self.client_options = {
+                "maxPoolSize": int(os.getenv("MONGO_MAX_POOL_SIZE", 100)),
+                "minPoolSize": int(os.getenv("MONGO_MIN_POOL_SIZE", 10)),
+                "maxIdleTimeMS": int(os.getenv("MONGO_MAX_IDLE_TIME_MS", 300000)),
+                "connectTimeoutMS": int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", 5000)),
+                "serverSelectionTimeoutMS": int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000)),
+                "socketTimeoutMS": int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", 10000)),
+                "readPreference": os.getenv("MONGO_READ_PREFERENCE", "primary"),
+            }
 
     class Cache:
         """Redis connection configuration."""
@@ -109,6 +135,70 @@ class Config:
         def __init__(self) -> None:
             self.host = os.getenv("REDIS_HOST", "redis")
             self.port = os.getenv("REDIS_PORT", 6379)
+            self.namespace = os.getenv("CACHE_NAMESPACE", "weather:v1")
+            self.window = int(os.getenv("CACHE_WINDOW", 3600))  # seconds start/end are aligned to, 0 disables
+            # seconds reports stay fresh, the ingest invalidates the queries its new reports change before that
+            self.ttl = int(os.getenv("CACHE_TTL", 3600))
+            self.empty_ttl = int(os.getenv("CACHE_EMPTY_TTL", 60))
+            self.historic_ttl = int(os.getenv("CACHE_HISTORIC_TTL", 86400))  # time ranges that no longer change
+            self.prewarm = int(os.getenv("CACHE_PREWARM", 100))  # invalidated popular queries refilled by the ingest
+            self.popularity_flush = float(os.getenv("CACHE_POPULARITY_FLUSH", 10))  # seconds
+            self.popularity_decay = float(os.getenv("CACHE_POPULARITY_DECAY", 3600))  # seconds to halve, 0 disables
+            self.popular_size = int(os.getenv("CACHE_POPULAR_SIZE", 10000))  # queries kept in the ranking
+            # in-process tier in front of Redis, per worker
+            self.local_bytes = int(os.getenv("CACHE_LOCAL_BYTES", 64 * 1024 * 1024))
+            self.local_ttl = float(os.getenv("CACHE_LOCAL_TTL", 60))  # seconds, 0 disables the tier
+            # seconds an expired report may still be served while one caller refreshes it, 0 disables
+            self.stale_ttl = int(os.getenv("CACHE_STALE_TTL", 0))
+            self.lease_timeout = float(os.getenv("CACHE_LEASE_TIMEOUT", 5))  # seconds one worker may spend on a refill
+            # seconds a miss waits for another worker's refill before loading itself, well below RESPONSE_TIMEOUT
+            self.fill_wait = float(os.getenv("CACHE_FILL_WAIT", 1))
+
+    class _Collector:
+        """Weather data collector configuration."""
+
+        def __init__(self) -> None:
+            self.concurrency = int(os.getenv("COLLECTOR_CONCURRENCY", 50))
+            self.limit_per_host = int(os.getenv("COLLECTOR_LIMIT_PER_HOST", 20))
+            self.keepalive_timeout = float(os.getenv("COLLECTOR_KEEPALIVE_TIMEOUT", 30))
+            self.timeout = float(os.getenv("COLLECTOR_TIMEOUT", 15))
+            self.batch_size = int(os.getenv("COLLECTOR_BATCH_SIZE", 500))
+            self.lookback = int(os.getenv("COLLECTOR_LOOKBACK", 86400))
+            self.max_attempts = int(os.getenv("COLLECTOR_MAX_ATTEMPTS", 3))
+            self.backoff_base = float(os.getenv("COLLECTOR_BACKOFF_BASE", 0.5))
+            self.backoff_max = float(os.getenv("COLLECTOR_BACKOFF_MAX", 10))
+            self.deadline = float(os.getenv("COLLECTOR_DEADLINE", 60))
+            self.breaker_threshold = int(os.getenv("COLLECTOR_BREAKER_THRESHOLD", 20))
+            self.breaker_reset_timeout = float(os.getenv("COLLECTOR_BREAKER_RESET_TIMEOUT", 30))
+
+    class _Server:
+        """Server run mode configuration."""
+
+        def __init__(self) -> None:
+            self.host = os.getenv("HOST", "0.0.0.0")
+            self.port = int(os.getenv("PORT", 8000))
+            self.mode = os.getenv("RUN_MODE", "development")  # "production" or "development"
+            self.workers = int(os.getenv("WORKERS", 0))  # 0 means one per available CPU in production
+
+        def run_options(self) -> dict:
+            """Keyword arguments of Sanic.run for the run mode"""
+            if self.mode != "production":
+                return dict(host=self.host, port=self.port, workers=self.workers or 1, debug=Config.APIConfig.DEBUG)
+            # The main process binds the socket and every worker process accepts on it
+            workers = self.workers or len(os.sched_getaffinity(0))
+            return dict(host=self.host, port=self.port, workers=workers, debug=False, access_log=False)
+
+    class _Profiling:
+        """Request profiling configuration."""
+
+        def __init__(self) -> None:
+            # value of the X-Profile header that profiles a request and of the X-Admin-Token header of the dumps,
+            # empty disables both
+            self.token = os.getenv("PROFILE_TOKEN", "")
+            self.sample_rate = float(os.getenv("PROFILE_SAMPLE_RATE", 0))  # share of requests profiled
+            self.slow_request = float(os.getenv("SLOW_REQUEST_MS", 0)) / 1000  # seconds, 0 disables span logging
+            self.directory = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "weather-profiles"))
+            self.keep = int(os.getenv("PROFILE_KEEP", 20))  # newest dumps kept in directory
 
 
 def get_config() -> Config:
@@ -0,0 +1,102 @@
+"""Time-bucketed statistics of weather reports.
+
+The database groups reports into partial statistics per station and bucket: the number of reports and,
+for every metric, the number of values with their sum, min and max. Partials can be merged, and are only
+turned into the requested statistics at the end.
+"""
+from typing import Dict, Iterable, Optional
+
+from app.service.models import Observation
+
+METRICS = ("temperature", "pressure", "wind_speed")
+STATISTICS = ("min", "max", "mean", "count")
+MIN_BUCKET = 60
+MAX_BUCKETS = 1000  # buckets per station of one request
+
+
+def parse_choices(value: Optional[str], choices: tuple[str, ...]) -> list[str]:
+    """Parse a comma-separated choice list, all choices if value is empty, raises ValueError for unknown ones"""
+    if not value:
+        return list(choices)
+    chosen = [item.strip() for item in value.split(",") if item.strip()]
+    unknown = [item for item in chosen if item not in choices]
+    if unknown or not chosen:
+        raise ValueError(f"must be a comma-separated list of {', '.join(choices)}")
+    return chosen
+
+
+def partials_of(observations: Iterable[Observation], bucket: int, metrics: Iterable[str] = METRICS) -> list[Dict]:
+    """Partial statistics of observations per station and bucket"""
+    partials: Dict[tuple[str, int], Dict] = {}
+    for observation in observations:
+        key = (observation.icao, observation.date - observation.date % bucket)
+        partial = partials.get(key)
+        if partial is None:
+            partial = {"icao": key[0], "bucket": key[1], "count": 0}
+            partial.update({metric: {"n": 0, "sum": 0, "min": None, "max": None} for metric in metrics})
+            partials[key] = partial
+        partial["count"] += 1
+        for metric in metrics:
+            value = getattr(observation, metric)
+            if value is None:
+                continue
+            values = partial[metric]
+            values["n"] += 1
+            values["sum"] += value
+            if values["min"] is None or value < values["min"]:
+                values["min"] = value
+            if values["max"] is None or value > values["max"]:
+                values["max"] = value
+    return list(partials.values())
+
+
+def choose_rollup(bucket: int, start: int, end: int, rollups: Iterable[int]) -> Optional[int]:
+    """Coarsest rollup granularity that divides bucket and has at least one whole bucket within start to end"""
+    for granularity in sorted(rollups, reverse=True):
+        if bucket % granularity == 0 and -(-start // granularity) * granularity + granularity <= end + 1:
+            return granularity
+    return None
+
+
+def merge_partials(partials: Iterable[Dict], bucket: int, metrics: list[str]) -> list[Dict]:
+    """Merge partials of finer buckets into buckets of bucket seconds, ordered by station and bucket"""
+    merged: Dict[tuple[str, int], Dict] = {}
+    for partial in partials:
+        key = (partial["icao"], partial["bucket"] - partial["bucket"] % bucket)
+        target = merged.get(key)
+        if target is None:
+            merged[key] = {
+                "icao": key[0],
+                "bucket": key[1],
+                "count": partial["count"],
+                **{metric: {"min": None, "max": None, **partial[metric]} for metric in metrics},
+            }
+            continue
+        target["count"] += partial["count"]
+        for metric in metrics:
+            into, other = target[metric], partial[metric]
+            into["n"] += other["n"]
+            into["sum"] += other["sum"]
+            if other.get("min") is not None and (into["min"] is None or other["min"] < into["min"]):
+                into["min"] = other["min"]
+            if other.get("max") is not None and (into["max"] is None or other["max"] > into["max"]):
+                into["max"] = other["max"]
+    return [merged[key] for key in sorted(merged)]
+
+
+def finalize(partials: Iterable[Dict], metrics: list[str], statistics: list[str]) -> list[Dict]:
+    """Turn partials into response rows with the requested statistics of every metric"""
+    rows = []
+    for partial in partials:
+        row: Dict = {"icao": partial["icao"], "bucket": partial["bucket"], "count": partial["count"]}
+        for metric in metrics:
+            values = partial[metric]
+            computed = {
+                "min": values["min"],
+                "max": values["max"],
+                "mean": values["sum"] / values["n"] if values["n"] else None,
+                "count": values["n"],
+            }
+            row[metric] = {statistic: computed[statistic] for statistic in statistics}
+        rows.append(row)
+    return rows
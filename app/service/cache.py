@@ -1,5 +1,7 @@
 from abc import ABC, abstractmethod
-from typing import Dict
+from typing import Dict, Optional
+
+from app.service.models import Geo, Id, Query
 
 
 class CacheMiss(Exception):
@@ -8,21 +10,73 @@ class CacheMiss(Exception):
     pass
 
 
+class CacheStale(CacheMiss):
+    """Exception raised when only an expired report is cached, the report can be served while it is refreshed"""
+
+    def __init__(self, report: list[Dict]) -> None:
+        super().__init__()
+        self.report = report
+
+
+def align_window(start: int, end: int, window: int) -> tuple[int, int]:
+    """Widen start and end to whole windows of window seconds, so that close time ranges share a cache entry"""
+    if window <= 0:
+        return start, end
+    return start - start % window, end - end % window + window - 1
+
+
+def trim_window(rows: list[Dict], start: int, end: int) -> list[Dict]:
+    """Rows of an aligned time range that fall within start and end"""
+    return [row for row in rows if start <= row["date"] <= end]
+
+
 class CacheWrapper(ABC):  # Repository
     """Abstract EventsCacheWrapper class that provides access to the cache"""
 
     @abstractmethod
-    async def get_geo_query(self, icao: dict) -> list[Dict]:
+    async def get_geo_query(self, query: Geo) -> list[Dict]:
+        pass
+
+    @abstractmethod
+    async def get_id_query(self, query: Id) -> list[Dict]:
+        pass
+
+    @abstractmethod
+    async def set_geo_query(self, query: Geo, report: list[Dict], stations: Optional[list[str]] = None) -> None:
+        pass
+
+    @abstractmethod
+    async def set_id_query(self, query: Id, report: list[Dict]) -> None:
+        pass
+
+    @abstractmethod
+    async def peek_query(self, query: Query) -> Optional[list[Dict]]:
+        pass
+
+    @abstractmethod
+    async def get_id_queries(self, queries: list[Id]) -> Dict[Id, list[Dict]]:
+        pass
+
+    @abstractmethod
+    async def set_id_queries(self, reports: Dict[Id, list[Dict]]) -> None:
+        pass
+
+    @abstractmethod
+    async def invalidate(self, changes: Dict[str, tuple[int, int]]) -> list[Query]:
+        pass
+
+    @abstractmethod
+    async def most_popular(self, queries: list[Query], limit: int) -> list[Query]:
         pass
 
     @abstractmethod
-    async def get_id_query(self, user_id: dict) -> list[Dict]:
+    def query_key(self, query: Query) -> str:
         pass
 
     @abstractmethod
-    async def set_geo_query(self, icao: dict, report: list[Dict]) -> None:
+    async def acquire_lease(self, key: str) -> Optional[str]:
         pass
 
     @abstractmethod
-    async def set_id_query(self, icao: dict, report: list[Dict]) -> None:
+    async def release_lease(self, key: str, token: str) -> None:
         pass
@@ -1,57 +1,181 @@
-import requests
 import asyncio
+import logging
+from typing import Any, AsyncIterator, Dict, Iterable, Optional
+
 import aiohttp  # type: ignore
-from aiohttp import ClientConnectorError, ClientOSError
 
-from app.service.get_data.process_data import ProcessStationData, ProcessStationsText  # type: ignore
+from app.service.get_data.process_data import (  # type: ignore
+    ProcessStationData,
+    ProcessStationsText,
+    parse_station_listing,
+)
 from app.storage.mongo_client import DB
+from app.service.models import Observation
+from app.service.get_data.retry import CircuitBreaker, CircuitOpen, RetryPolicy
+from app.cfg import config
+
+logger = logging.getLogger(__name__)
 
 
 class CollectData(object):
+    """Downloads stations.txt and feeds it into the station catalog.
+
+    The database keeps the ETag/Last-Modified validators of the last processed download,
+    so an unchanged file is answered with 304 and skipped.
+    """
+
+    stations_url = "https://www.aviationweather.gov/docs/metar/stations.txt"
+    validators_key = "stations_txt"
+
     def __init__(
         self,
         stations: ProcessStationsText,
         database: DB,
+        timeout: float = config.collector.timeout,
     ) -> None:
         self.stations = stations
         self.database = database
+        self.timeout = timeout
+
+    @staticmethod
+    async def iter_lines(resp: aiohttp.ClientResponse) -> AsyncIterator[str]:
+        """Yield decoded response lines as they are received"""
+        async for line in resp.content:
+            yield line.decode("latin-1")
 
-    async def get_stations_txt(self) -> None:
-        """Download stations.txt"""
-        self.resp: requests.Response = requests.get("https://www.aviationweather.gov/docs/metar/stations.txt")
+    async def get_stations_txt(self) -> Optional[Dict[str, int]]:
+        """Stream stations.txt into the station catalog, returns added/changed/removed counts or None if unchanged"""
+        validators = await self.database.get_document(self.validators_key) or {}
+        headers = {}
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
 
-        with open("stations.txt", "w") as file:
-            file.write(self.resp.text)
+        timeout = aiohttp.ClientTimeout(total=None, sock_read=self.timeout)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            async with session.get(self.stations_url, headers=headers) as resp:
+                if resp.status == 304:
+                    return None
+                resp.raise_for_status()
+                counts = await self.stations.process_stations(self.iter_lines(resp))
+                validators = {"etag": resp.headers.get("ETag"), "last_modified": resp.headers.get("Last-Modified")}
 
-        await self.stations.process_stations_txt()
+        await self.database.set_document(self.validators_key, validators)
+        return counts
 
 
 class CollectWeatherData(object):
-    def __init__(self, station_weather_data: ProcessStationData, db_weather_data: DB) -> None:
+    """Collects weather reports over one pooled HTTP session.
+
+    Use as an async context manager: the session and its connection pool live for the whole harvest
+    and every station request goes through a shared concurrency limiter.
+    """
+
+    base_url = "https://tgftp.nws.noaa.gov/data/observations/metar/decoded/"
+
+    def __init__(
+        self,
+        station_weather_data: ProcessStationData,
+        concurrency: int = config.collector.concurrency,
+        limit_per_host: int = config.collector.limit_per_host,
+        keepalive_timeout: float = config.collector.keepalive_timeout,
+        timeout: float = config.collector.timeout,
+        retry_policy: Optional[RetryPolicy] = None,
+        breaker: Optional[CircuitBreaker] = None,
+    ) -> None:
         self.station_weather_data = station_weather_data
-        self.db_weather_data = db_weather_data
+        self.concurrency = concurrency
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = timeout
+        self.retry_policy = retry_policy or RetryPolicy(attempt_timeout=timeout)
+        self.breaker = breaker or CircuitBreaker()
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._session: Optional[aiohttp.ClientSession] = None
 
-    async def get_station_data(self, icao: str) -> None:
-        """Get station data for every icao, make task for process file and upload weather data to database."""
-        base_url = "https://tgftp.nws.noaa.gov/data/observations/metar/decoded/"
+    async def __aenter__(self) -> "CollectWeatherData":
+        connector = aiohttp.TCPConnector(
+            limit=self.concurrency,
+            limit_per_host=self.limit_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+            ttl_dns_cache=300,
+        )
+        self._session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """Shared HTTP session, available inside the context manager only"""
+        if self._session is None:
+            raise RuntimeError("CollectWeatherData must be used as an async context manager")
+        return self._session
+
+    async def fetch_listing(self) -> str:
+        """Download the decoded reports directory listing"""
+        async with self.session.get(f"{self.base_url}?C=M;O=D") as resp:
+            resp.raise_for_status()
+            return await resp.text()
+
+    async def get_station_listing(self) -> Dict[str, int]:
+        """Get every station of the decoded reports directory with the mtime of its report"""
+        listing = await self.retry_policy.call(self.fetch_listing, self.breaker)
+        return parse_station_listing(listing)
+
+    async def fetch_report(self, icao: str) -> Optional[str]:
+        """Download the decoded report of one station, None if the station has no report"""
+        async with self.session.get(f"{self.base_url}{icao}.TXT") as resp:
+            if resp.status >= 500:
+                resp.raise_for_status()
+            if resp.status != 200:
+                return None
+            return await resp.text()
+
+    async def get_station_data(self, icao: str) -> Optional[Observation]:
+        """Get station data for one icao and process it, None if there is no usable report.
+
+        A failing station never raises, so that it cannot abort the batch of the other stations.
+        """
+        try:
+            return await self._get_station_data(icao)
+        except Exception:
+            logger.exception(f"Collecting {icao} failed")
+            return None
+
+    async def _get_station_data(self, icao: str) -> Optional[Observation]:
         try:
-            sem = asyncio.Semaphore(1)
-            async with sem:
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(f"{base_url}{icao}.TXT") as resp:
-                        if resp.status == 200:
-                            data = await resp.text()
-                            station_dict = await self.station_weather_data.process_station_data(
-                                station_data=data, icao=icao
-                            )
-                            await self.db_weather_data.timestamps_upload(station_dict)
-        except ValueError:
-            pass
-        except asyncio.TimeoutError:
-            await self.get_station_data(icao)
-        except ClientConnectorError:
-            await asyncio.sleep(5)
-            await self.get_station_data(icao)
-        except ClientOSError:
-            await self.get_station_data(icao)
-        await asyncio.sleep(20)
+            async with self._semaphore:
+                data = await self.retry_policy.call(lambda: self.fetch_report(icao), self.breaker)
+        except CircuitOpen:
+            logger.debug(f"Circuit open, skipping {icao}")
+            return None
+        except self.retry_policy.retry_on as exc:
+            logger.warning(f"Giving up on {icao}: {exc!r}")
+            return None
+        if data is None:
+            return None
+        try:
+            return await self.station_weather_data.process_station_data(station_data=data, icao=icao)
+        except (ValueError, IndexError):
+            return None
+
+    async def iter_batches(
+        self, icao_list: Iterable[str], batch_size: int = config.collector.batch_size
+    ) -> AsyncIterator[list[Observation]]:
+        """Fetch all stations concurrently and yield processed reports in batches of up to batch_size"""
+        batch: list[Observation] = []
+        for report in asyncio.as_completed([self.get_station_data(icao) for icao in icao_list]):
+            observation = await report
+            if observation is None:
+                continue
+            batch.append(observation)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
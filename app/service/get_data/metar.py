@@ -0,0 +1,71 @@
+"""Parser of decoded METAR reports published by tgftp.nws.noaa.gov.
+
+A decoded report looks like::
+
+    Chicago O'Hare International Airport, IL, United States (KORD) 41-59N 087-54W 201M
+    Oct 18, 2022 - 10:51 AM EDT / 2022.10.18 1451 UTC
+    Wind: from the W (270 degrees) at 12 MPH (10 KT):0
+    Temperature: 55.9 F (13.3 C)
+    Pressure (altimeter): 30.05 in. Hg (1017 hPa)
+    ...
+"""
+import calendar
+import re
+from typing import Iterable, Optional
+
+from app.service.models import Observation
+
+__all__ = ["parse_decoded_report", "parse_decoded_reports"]
+
+_DATE = re.compile(r"/ (\d{4})\.(\d\d)\.(\d\d) (\d\d)(\d\d) UTC")
+_TEMPERATURE = re.compile(r"(-?\d+(?:\.\d+)?) C\b")
+_PRESSURE = re.compile(r"(-?\d+) hPa")
+_WIND_DIRECTION = re.compile(r"(\d+) degrees")
+_WIND_SPEED = re.compile(r"(\d+) KT")
+
+
+def parse_decoded_report(report: str, icao: str) -> Observation:
+    """Parse a decoded report in one pass over its lines, raises ValueError if it has no observation time"""
+    lines = report.split("\n")
+    date_match = _DATE.search(lines[1]) if len(lines) > 1 else None
+    if date_match is None:
+        raise ValueError(f"{icao}: report has no observation time")
+    year, month, day, hour, minute = map(int, date_match.groups())
+    date = calendar.timegm((year, month, day, hour, minute, 0))
+
+    temperature: Optional[float] = None
+    pressure: Optional[int] = None
+    wind_direction: Optional[int] = None
+    wind_speed: Optional[int] = None
+    for line in lines[2:]:
+        if line.startswith("Temperature"):
+            match = _TEMPERATURE.search(line)
+            if match is not None:
+                temperature = float(match.group(1))
+        elif line.startswith("Pressure"):
+            match = _PRESSURE.search(line)
+            if match is not None:
+                pressure = int(match.group(1))
+        elif line.startswith("Wind:"):
+            if "Calm" in line:
+                wind_speed = 0
+                continue
+            match = _WIND_DIRECTION.search(line)
+            if match is not None:
+                wind_direction = int(match.group(1))
+            match = _WIND_SPEED.search(line)
+            if match is not None:
+                wind_speed = int(match.group(1))
+
+    return Observation(icao, date, temperature, pressure, wind_direction, wind_speed)
+
+
+def parse_decoded_reports(reports: Iterable[tuple[str, str]]) -> list[Observation]:
+    """Parse many (icao, report) pairs, malformed reports are skipped"""
+    observations = []
+    for icao, report in reports:
+        try:
+            observations.append(parse_decoded_report(report, icao))
+        except ValueError:
+            continue
+    return observations
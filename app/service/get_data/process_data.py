@@ -1,93 +1,75 @@
-import time
+import calendar
 import re
-import os
-from datetime import timedelta, datetime as dt
+import time
+from app.service.get_data.metar import parse_decoded_report
+from app.service.models import Observation
 from app.storage.mongo_client import DB
-from typing import Dict, Union
-import requests
+from typing import AsyncIterable, Dict, Optional
+
+_LISTING_ENTRY = re.compile(r'href="(\w{4})\.TXT".*?(\d\d-\w{3}-\d{4} \d\d:\d\d)')
 
 
 class ProcessStationData(object):
     def __init__(self, storage: DB):
         self.storage = storage
 
-    async def process_station_data(self, station_data: str, icao: str) -> Dict[str, Union[str, int, float]]:
-        """Process station data into dictionary format"""
-        self.station_dict: dict = {
-            "icao": icao,
-            "date": "",
-            "temperature": "",
-            "pressure": "",
-            "wind_direction": "",
-            "wind_speed": "",
-        }
-
-        station_data_arr = station_data.split("\n")
-        data_collection_time = station_data_arr[1].split("/ ")[1]
-        self.station_dict["date"] = int(time.mktime(dt.strptime(data_collection_time, "%Y.%m.%d %H%M UTC").timetuple()))
-        for item in station_data_arr:
-            if item.startswith("Temperature"):
-                temp_data = re.search(r"(\d*\.|)\d* C", item)
-                if temp_data is not None:
-                    self.station_dict["temperature"] = temp_data.group().split()[0]
-            elif item.startswith("Pressure"):
-                pressure_data = re.search(r"(-|)\d* hPa", item)
-                if pressure_data is not None:
-                    self.station_dict["pressure"] = pressure_data.group().split()[0]
-            elif item.startswith("Wind:"):
-                if "Calm" in item:
-                    self.station_dict["wind_speed"] = "0"
-                else:
-                    wind_direction_data = re.search(r"\d* degrees", item)
-                    wind_speed_data = re.search(r"\d* KT", item)
-                    if wind_direction_data is not None:
-                        self.station_dict["wind_direction"] = wind_direction_data.group().split()[0].lstrip("0")
-                    if wind_speed_data is not None:
-                        self.station_dict["wind_speed"] = wind_speed_data.group().split()[0]
-        return self.station_dict
+    async def process_station_data(self, station_data: str, icao: str) -> Observation:
+        """Process station data into an observation"""
+        return parse_decoded_report(station_data, icao)
 
 
 class ProcessStationsText(object):
     def __init__(self, storage: DB):
         self.storage = storage
-        self.icao: dict = {}
 
-    async def process_stations_txt(self) -> None:
-        """Get stations.txt from the server and process file"""
+    @staticmethod
+    def parse_station_line(line: str) -> Optional[dict]:
+        """Parse one stations.txt line into a station document.
+
+        None for headers, stations without coordinates and truncated or malformed lines.
+        """
+        if line.startswith("!") or " " in line[39:41] or "STATION" in line or len(line) < 54:
+            return None
+        icao_index = line[20:24]
+        if not icao_index.strip():
+            return None
+        try:
+            lat_index = round(int(line[39:41]) + int(line[42:44]) / 60, 6)
+            long_index = round(int(line[47:50]) + int(line[51:53]) / 60, 6)
+        except ValueError:
+            return None
+        if line[44] == "S":
+            lat_index = -lat_index
+        if line[53] == "W":
+            long_index = -long_index
+
+        return {
+            "icao": icao_index,
+            "location": {
+                "type": "Point",
+                "coordinates": [long_index, lat_index],
+            },
+        }
+
+    async def process_stations(self, lines: AsyncIterable[str]) -> Dict[str, int]:
+        """Parse stations.txt as its lines arrive and sync the station catalog with it"""
+        stations: Dict[str, dict] = {}
+        async for line in lines:
+            station = self.parse_station_line(line)
+            if station is not None:
+                stations.setdefault(station["icao"], station)
 
-        with open("stations.txt", "r") as base:
-            index = 0
-            for line in base:
-                if not line.startswith("!") and " " not in line[39:41] and "STATION" not in line and line[39:41] != "":
-                    icao_index = line[20:24]
-                    lat_index = round(int(line[39:41]) + int(line[42:44]) / 60, 6)
-                    long_index = round(int(line[47:50]) + int(line[51:53]) / 60, 6)
+        return await self.storage.icao_sync(stations)
 
-                    self.icao[index] = {
-                        "icao": icao_index,
-                        "location": {
-                            "type": "Point",
-                            "coordinates": [long_index, lat_index],
-                        },
-                    }
-                    await self.storage.icao_upload(icao_data=self.icao[index])
-                    index += 1
 
-        os.remove("stations.txt")
+def parse_station_listing(listing: str) -> Dict[str, int]:
+    """Parse the decoded reports directory listing into icao -> report file mtime, as UTC epoch"""
+    stations = {}
+    for match in _LISTING_ENTRY.finditer(listing):
+        stations[match.group(1)] = calendar.timegm(time.strptime(match.group(2), "%d-%b-%Y %H:%M"))
+    return stations
 
 
-async def get_stations_to_parse() -> list[str]:
-    """Get stations array with new reports in last 30 minutes"""
-    url = "https://tgftp.nws.noaa.gov/data/observations/metar/decoded/?C=M;O=D"
-    response = requests.get(url)
-    response_split = response.text.split("\n")
-    icao = []
-    for item in response_split[9:-4]:
-        date_report = item[62:79]
-        datetime_format = dt.strptime(date_report, "%d-%b-%Y %H:%M")
-        if dt.utcnow() - datetime_format <= timedelta(minutes=30):
-            icao_name = item[27:31]
-            icao.append(icao_name)
-        else:
-            break
-    return icao
+def get_stations_to_parse(listing: Dict[str, int], watermarks: Dict[str, int], since: int) -> list[str]:
+    """Get stations with a report newer than their watermark, ignoring reports older than since"""
+    return [icao for icao, mtime in listing.items() if mtime >= since and mtime > watermarks.get(icao, 0)]
@@ -0,0 +1,109 @@
+"""Retry policy and circuit breaker for upstream HTTP calls."""
+import asyncio
+import random
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional, Tuple, Type, TypeVar
+
+from aiohttp import ClientError  # type: ignore
+
+from app.cfg import config
+
+T = TypeVar("T")
+
+
+class CircuitOpen(Exception):
+    """Exception raised when the circuit breaker rejects a call"""
+
+    pass
+
+
+class CircuitBreaker(object):
+    """Consecutive-failure circuit breaker.
+
+    After `failure_threshold` failures in a row the circuit opens and calls are rejected for `reset_timeout`
+    seconds. Then a single trial call is let through: success closes the circuit, failure opens it again.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = config.collector.breaker_threshold,
+        reset_timeout: float = config.collector.breaker_reset_timeout,
+    ) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_flight = False
+
+    def before_call(self) -> None:
+        """Raise CircuitOpen if the call must not reach the upstream"""
+        if self.opened_at is None:
+            return
+        if time.monotonic() - self.opened_at < self.reset_timeout or self._trial_in_flight:
+            raise CircuitOpen
+        self._trial_in_flight = True
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    def release_trial(self) -> None:
+        """Let another trial call through after one ended without a verdict"""
+        self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self._trial_in_flight or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self._trial_in_flight = False
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """Bounded retry with exponential backoff and full jitter.
+
+    Every attempt is limited by `attempt_timeout`, all attempts together by `deadline`.
+    """
+
+    max_attempts: int = config.collector.max_attempts
+    base_delay: float = config.collector.backoff_base
+    max_delay: float = config.collector.backoff_max
+    attempt_timeout: float = config.collector.timeout
+    deadline: float = config.collector.deadline
+    # ClientError covers connection errors, such as a pooled connection the server closed, payload and status errors
+    retry_on: Tuple[Type[BaseException], ...] = (asyncio.TimeoutError, ClientError)
+
+    def backoff(self, attempt: int) -> float:
+        """Delay before the retry following `attempt` (zero-based)"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+    async def call(self, func: Callable[[], Awaitable[T]], breaker: Optional[CircuitBreaker] = None) -> T:
+        """Await func() until it succeeds, attempts run out or the deadline passes"""
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            if breaker is not None:
+                breaker.before_call()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise asyncio.TimeoutError
+            try:
+                result = await asyncio.wait_for(func(), timeout=min(self.attempt_timeout, remaining))
+            except self.retry_on:
+                if breaker is not None:
+                    breaker.record_failure()
+                attempt += 1
+                delay = self.backoff(attempt - 1)
+                if attempt >= self.max_attempts or time.monotonic() + delay >= deadline:
+                    raise
+                await asyncio.sleep(delay)
+            except BaseException:
+                if breaker is not None:
+                    breaker.release_trial()
+                raise
+            else:
+                if breaker is not None:
+                    breaker.record_success()
+                return result
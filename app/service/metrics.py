@@ -0,0 +1,176 @@
+"""In-process metrics in the Prometheus text format."""
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from typing import Generic, TypeVar
+
+# Seconds, from a local cache hit to a slow aggregation
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ROWS_BUCKETS = (0, 1, 10, 100, 1000, 10_000, 100_000)
+
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Counter(object):
+    __slots__ = ("value",)
+
+    def __init__(self) -> None:
+        self.value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+
+class _Gauge(_Counter):
+    __slots__ = ()
+
+    def dec(self, amount: float = 1) -> None:
+        self.value -= amount
+
+
+class _Histogram(object):
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: tuple[float, ...]) -> None:
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # the last one counts the samples above every bound
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+Child = TypeVar("Child", _Counter, _Gauge, _Histogram)
+M = TypeVar("M", bound="Metric")
+
+
+class Metric(ABC, Generic[Child]):
+    """A metric family, samples are recorded on the child of their label values"""
+
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._children: dict[tuple[str, ...], Child] = {}
+
+    @abstractmethod
+    def _child(self) -> Child:
+        pass
+
+    def labels(self, *values: str) -> Child:
+        """Child of the label values, created on first use"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} has labels {self.labelnames}, got {values}")
+            child = self._children[values] = self._child()
+        return child
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in sorted(self._children.items()):
+            lines += self._samples(_labels(self.labelnames, values), values, child)
+        return lines
+
+    @abstractmethod
+    def _samples(self, labels: str, values: tuple[str, ...], child: Child) -> list[str]:
+        pass
+
+
+class Counter(Metric[_Counter]):
+    kind = "counter"
+
+    def _child(self) -> _Counter:
+        return _Counter()
+
+    def _samples(self, labels: str, values: tuple[str, ...], child: _Counter) -> list[str]:
+        return [f"{self.name}{labels} {_number(child.value)}"]
+
+
+class Gauge(Metric[_Gauge]):
+    kind = "gauge"
+
+    def _child(self) -> _Gauge:
+        return _Gauge()
+
+    def _samples(self, labels: str, values: tuple[str, ...], child: _Gauge) -> list[str]:
+        return [f"{self.name}{labels} {_number(child.value)}"]
+
+
+class Histogram(Metric[_Histogram]):
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: tuple[str, ...] = (), buckets: tuple[float, ...] = ()
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets or LATENCY_BUCKETS))
+
+    def _child(self) -> _Histogram:
+        return _Histogram(self.buckets)
+
+    def _samples(self, labels: str, values: tuple[str, ...], child: _Histogram) -> list[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+            cumulative += count
+            le = 'le="+Inf"' if bound == float("inf") else f'le="{_number(bound)}"'
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, values, le)} {cumulative}")
+        lines.append(f"{self.name}_sum{labels} {_number(child.sum)}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry(object):
+    """Metrics of one worker process"""
+
+    def __init__(self) -> None:
+        self._metrics: dict[str, Metric] = {}
+
+    def register(self, metric: M) -> M:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in self._metrics.values():
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUEST_SECONDS = registry.register(
+    Histogram("weather_request_seconds", "Request latency by route, method and status.", ("route", "method", "status"))
+)
+REQUESTS_IN_FLIGHT = registry.register(Gauge("weather_requests_in_flight", "Requests being handled.")).labels()
+CACHE_REQUESTS = registry.register(
+    Counter("weather_cache_requests_total", "Cache lookups by tier and result.", ("tier", "result"))
+)
+MONGO_QUERY_SECONDS = registry.register(
+    Histogram("weather_mongo_query_seconds", "Mongo query time until every row is read.", ("query",))
+)
+MONGO_ROWS = registry.register(
+    Histogram("weather_mongo_rows", "Rows returned per Mongo query.", ("query",), buckets=ROWS_BUCKETS)
+)
+SERIALIZE_SECONDS = registry.register(
+    Histogram("weather_serialize_seconds", "Time to serialize a response body.")
+).labels()
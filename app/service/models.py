@@ -1,7 +1,8 @@
 from dataclasses import dataclass
+from typing import Optional, Union
 
 
-@dataclass()
+@dataclass(frozen=True, slots=True)
 class Id:
     """Schema dataclass for /id requests"""
 
@@ -10,12 +11,50 @@ class Id:
     end: int
 
 
-@dataclass()
+@dataclass(frozen=True, slots=True)
 class Geo:
     """Schema dataclass for /geo requests"""
 
     lat: float
-    long: float
+    lon: float
     radius: int
     start: int
     end: int
+
+
+Query = Union[Id, Geo]
+
+
+@dataclass(frozen=True, slots=True)
+class Aggregate:
+    """Schema dataclass for the bucket and statistics of aggregate requests"""
+
+    bucket: int
+    metrics: tuple[str, ...]
+    statistics: tuple[str, ...]
+
+
+OBSERVATION_FIELDS = ("icao", "date", "temperature", "pressure", "wind_direction", "wind_speed")
+
+
+@dataclass(frozen=True, slots=True)
+class Observation:
+    """Decoded METAR report of one station, missing values are None"""
+
+    icao: str
+    date: int
+    temperature: Optional[float] = None
+    pressure: Optional[int] = None
+    wind_direction: Optional[int] = None
+    wind_speed: Optional[int] = None
+
+    def to_document(self) -> dict:
+        """Storage document of the observation"""
+        return {
+            "icao": self.icao,
+            "date": self.date,
+            "temperature": self.temperature,
+            "pressure": self.pressure,
+            "wind_direction": self.wind_direction,
+            "wind_speed": self.wind_speed,
+        }
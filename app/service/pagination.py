@@ -0,0 +1,50 @@
+"""Cursor-based pagination of report queries.
+
+Pages are ordered by (date, icao); the continuation token is the opaque encoding of the last row's key.
+"""
+import base64
+import binascii
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+import ujson  # type: ignore
+
+
+@dataclass(frozen=True, slots=True)
+class PageRequest:
+    """Up to limit rows ordered by (date, icao), starting after the key after"""
+
+    limit: int
+    after: Optional[tuple[int, str]] = None
+
+
+@dataclass(frozen=True, slots=True)
+class Page:
+    """Rows of one page and the token of the next one, None on the last page"""
+
+    rows: list[Dict]
+    next_cursor: Optional[str] = None
+
+
+def encode_cursor(row: Dict) -> str:
+    """Continuation token pointing right after row"""
+    return base64.urlsafe_b64encode(ujson.dumps([row["date"], row["icao"]]).encode()).decode()
+
+
+def decode_cursor(token: str) -> tuple[int, str]:
+    """Key encoded in a continuation token, raises ValueError for a malformed token"""
+    try:
+        date, icao = ujson.loads(base64.urlsafe_b64decode(token.encode()))
+    except (binascii.Error, TypeError, ValueError):
+        raise ValueError("malformed cursor")
+    if not isinstance(date, int) or not isinstance(icao, str):
+        raise ValueError("malformed cursor")
+    return date, icao
+
+
+def paginate(rows: list[Dict], limit: int) -> Page:
+    """Build a page from up to limit + 1 rows, the extra row only tells there is a next page"""
+    if len(rows) <= limit:
+        return Page(rows)
+    rows = rows[:limit]
+    return Page(rows, encode_cursor(rows[-1]))
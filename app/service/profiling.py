@@ -0,0 +1,142 @@
+"""Per-request span trees and cProfile dumps."""
+import cProfile
+import functools
+import marshal
+import os
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+
+F = TypeVar("F", bound=Callable[..., Awaitable[Any]])
+
+
+class Span(object):
+    """A named stage of a request and the stages it ran"""
+
+    __slots__ = ("name", "started", "ended", "children")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.started = time.perf_counter()
+        self.ended: Optional[float] = None
+        self.children: list[Span] = []
+
+    @property
+    def duration(self) -> float:
+        return (self.ended if self.ended is not None else time.perf_counter()) - self.started
+
+    def finish(self) -> None:
+        self.ended = time.perf_counter()
+
+    def render(self, depth: int = 0) -> list[str]:
+        """The tree as lines indented by depth, with the start of every span relative to its parent"""
+        lines = [f"{'  ' * depth}{self.name} {self.duration * 1000:.2f} ms"]
+        for child in self.children:
+            offset = (child.started - self.started) * 1000
+            lines += [f"{line} @{offset:.2f}" if i == 0 else line for i, line in enumerate(child.render(depth + 1))]
+        return lines
+
+
+# Innermost span of the running request, None when the request is not traced
+_current: ContextVar[Optional[Span]] = ContextVar("span", default=None)
+
+
+def start_trace(name: str) -> Span:
+    """Trace the rest of the running request under a root span"""
+    root = Span(name)
+    _current.set(root)
+    return root
+
+
+def stop_trace(root: Span) -> None:
+    root.finish()
+    _current.set(None)
+
+
+def untraced() -> None:
+    """Do not trace the running request, the context of a connection outlives its requests"""
+    _current.set(None)
+
+
+class span(object):
+    """Record the block as a child of the current span, does nothing when the request is not traced"""
+
+    __slots__ = ("name", "_span", "_token")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._span: Optional[Span] = None
+
+    def __enter__(self) -> None:
+        parent = _current.get()
+        if parent is not None:
+            self._span = Span(self.name)
+            parent.children.append(self._span)
+            self._token = _current.set(self._span)
+
+    def __exit__(self, *exc: Any) -> None:
+        if self._span is not None:
+            self._span.finish()
+            _current.reset(self._token)
+
+
+def traced(name: str) -> Callable[[F], F]:
+    """Record every call of a coroutine function as a span"""
+
+    def decorate(func: F) -> F:
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if _current.get() is None:
+                return await func(*args, **kwargs)
+            with span(name):
+                return await func(*args, **kwargs)
+
+        return wrapper  # type: ignore
+
+    return decorate
+
+
+# cProfile hooks the whole interpreter, so one request of the worker is profiled at a time
+_profiling: Optional[cProfile.Profile] = None
+
+
+def start_profile() -> Optional[cProfile.Profile]:
+    """Start profiling the worker, None if it is already profiled for another request"""
+    global _profiling
+    if _profiling is not None:
+        return None
+    _profiling = cProfile.Profile()
+    _profiling.enable()
+    return _profiling
+
+
+def stop_profile(profile: cProfile.Profile) -> bytes:
+    """Stop profiling, returns the stats in the format of cProfile dump files"""
+    global _profiling
+    profile.disable()
+    _profiling = None
+    profile.create_stats()
+    return marshal.dumps(profile.stats)  # type: ignore
+
+
+def save_profile(directory: str, name: str, stats: bytes, keep: int) -> None:
+    """Write a dump into directory as name.prof and delete the oldest dumps beyond keep"""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{name}.prof")
+    with open(f"{path}.tmp", "wb") as dump:
+        dump.write(stats)
+    os.replace(f"{path}.tmp", path)
+    for old in list_profiles(directory)[keep:]:
+        try:
+            os.remove(os.path.join(directory, old))
+        except FileNotFoundError:  # removed by another worker
+            pass
+
+
+def list_profiles(directory: str) -> list[str]:
+    """Dump file names in directory, newest first"""
+    try:
+        names = [name for name in os.listdir(directory) if name.endswith(".prof")]
+    except FileNotFoundError:
+        return []
+    return sorted(names, reverse=True)
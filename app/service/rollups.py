@@ -0,0 +1,104 @@
+"""Time ranges the rollups are complete for."""
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from app.cfg import config
+from app.storage.mongo_client import DB
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_COVERAGE_KEY = "rollup_coverage"
+
+_Span = tuple[int, int, bool]  # first bucket, bucket after the last one, whether the rollup covers them
+
+
+def live_since() -> int:
+    """Reports dated before this are not expected to change anymore"""
+    # Reports are harvested up to lookback seconds after their listing time, and are a bit older than that
+    return int(time.time()) - 2 * config.collector.lookback
+
+
+def rollup_cutoff() -> int:
+    """live_since aligned down to whole buckets of every rollup, older reports are left to the rollup rebuild"""
+    # Every granularity divides the coarsest one
+    coarsest = max(config.mongo.rollups)
+    return live_since() // coarsest * coarsest
+
+
+class RollupCoverage(object):
+    """Time ranges in which every rollup holds all reports.
+
+    The rebuild recomputes the rollups from the reports dated before rebuilt_until. The ingest adds every report
+    dated from ingested_from on, except for reports older than the rollup cutoff, which are left to the next
+    rebuild. Anything else, or everything while neither is recorded, is aggregated from the raw reports.
+    """
+
+    def __init__(self, rebuilt_until: Optional[int] = None, ingested_from: Optional[int] = None) -> None:
+        self.rebuilt_until = rebuilt_until
+        self.ingested_from = ingested_from
+
+    def load(self, document: Optional[dict]) -> None:
+        """Replace the coverage with the one recorded in a meta document"""
+        document = document or {}
+        self.rebuilt_until = document.get("rebuilt_until")
+        self.ingested_from = document.get("ingested_from")
+
+    def _ingested_from(self, cutoff: int) -> Optional[int]:
+        return None if self.ingested_from is None else max(self.ingested_from, cutoff)
+
+    def covers(self, bucket: int, granularity: int, cutoff: int) -> bool:
+        """Whether the rollup of granularity holds every report of the bucket starting at bucket"""
+        if self.rebuilt_until is not None and bucket + granularity <= self.rebuilt_until:
+            return True
+        ingested_from = self._ingested_from(cutoff)
+        return ingested_from is not None and bucket >= ingested_from
+
+    def spans(self, first: int, stop: int, granularity: int, cutoff: int) -> list[_Span]:
+        """Split the buckets of granularity from first up to stop into runs the rollup covers or not"""
+        edges = {first, stop}
+        if self.rebuilt_until is not None:
+            edges.add(self.rebuilt_until // granularity * granularity)
+        ingested_from = self._ingested_from(cutoff)
+        if ingested_from is not None:
+            edges.add(-(-ingested_from // granularity) * granularity)
+        bounds = sorted(edge for edge in edges if first <= edge <= stop)
+        spans: list[_Span] = []
+        for start, end in zip(bounds, bounds[1:]):
+            covered = self.covers(start, granularity, cutoff)
+            if spans and spans[-1][2] == covered:
+                spans[-1] = (spans[-1][0], end, covered)
+            else:
+                spans.append((start, end, covered))
+        return spans
+
+
+async def load_rollup_coverage(coverage: RollupCoverage, db_meta: DB) -> None:
+    coverage.load(await db_meta.get_document(ROLLUP_COVERAGE_KEY))
+
+
+async def watch_rollup_coverage(coverage: RollupCoverage, db_meta: DB, interval: float) -> None:
+    """Reload the coverage every interval seconds"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await load_rollup_coverage(coverage, db_meta)
+        except Exception:
+            logger.exception("Rollup coverage refresh failed")
+
+
+async def mark_rollups_ingested(db_meta: DB, since: int) -> None:
+    """Record that the ingest adds every report dated from since on to the rollups"""
+    await db_meta.update_document(ROLLUP_COVERAGE_KEY, {"$min": {"ingested_from": since}})
+
+
+async def rollups_rebuilt_until(db_meta: DB) -> Optional[int]:
+    """Date the rollups were last rebuilt up to, None if they never were"""
+    document = await db_meta.get_document(ROLLUP_COVERAGE_KEY)
+    return document.get("rebuilt_until") if document else None
+
+
+async def mark_rollups_rebuilt(db_meta: DB, until: int) -> None:
+    """Record that the rollups hold every report dated before until"""
+    await db_meta.update_document(ROLLUP_COVERAGE_KEY, {"$max": {"rebuilt_until": until}})
@@ -0,0 +1,106 @@
+"""In-process spatial index of the station catalog."""
+import asyncio
+import logging
+import math
+from typing import Iterable, Optional
+
+from app.storage.mongo_client import DB
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS = 6371008.8  # mean radius, meters
+CATALOG_VERSION_KEY = "station_catalog"
+
+_Station = tuple[str, float, float, float]  # icao, latitude and longitude in radians, cosine of latitude
+
+
+class StationIndex(object):
+    """Stations bucketed into a latitude/longitude grid, answering radius queries with the haversine formula.
+
+    The catalog changes at most weekly, a reload builds a new grid and swaps it in at once.
+    """
+
+    def __init__(self, cell_size: float = 1.0) -> None:
+        self.cell_size = cell_size
+        self.columns = math.ceil(360 / cell_size)
+        self.version: Optional[float] = None
+        self.size = 0
+        self._cells: Optional[dict[tuple[int, int], list[_Station]]] = None
+
+    @property
+    def ready(self) -> bool:
+        return self._cells is not None
+
+    def _cell(self, lat: float, lon: float) -> tuple[int, int]:
+        return math.floor((lat + 90) / self.cell_size), math.floor((lon + 180) / self.cell_size) % self.columns
+
+    def load(self, stations: Iterable[dict], version: Optional[float] = None) -> None:
+        """Replace the indexed stations with station catalog documents"""
+        cells: dict[tuple[int, int], list[_Station]] = {}
+        size = 0
+        for station in stations:
+            lon, lat = station["location"]["coordinates"]
+            lat_rad = math.radians(lat)
+            cells.setdefault(self._cell(lat, lon), []).append(
+                (station["icao"], lat_rad, math.radians(lon), math.cos(lat_rad))
+            )
+            size += 1
+        self._cells, self.size, self.version = cells, size, version
+
+    def within(self, lat: float, lon: float, radius: float) -> list[str]:
+        """Get the ICAO of stations within radius meters of the point, nearest first"""
+        if self._cells is None:
+            raise RuntimeError("StationIndex is not loaded")
+        cells = self._cells
+        angle = radius / EARTH_RADIUS
+        if angle >= math.pi:
+            rows, columns = range(math.ceil(180 / self.cell_size)), range(self.columns)
+        else:
+            lat_span = math.degrees(angle)
+            low, high = self._cell(max(lat - lat_span, -90), lon)[0], self._cell(min(lat + lat_span, 90), lon)[0]
+            rows = range(low, high + 1)
+            spread = math.sin(angle) / max(math.cos(math.radians(lat)), 1e-12)
+            if lat + lat_span >= 90 or lat - lat_span <= -90 or spread >= 1:
+                columns = range(self.columns)
+            else:
+                lon_span = math.degrees(math.asin(spread))
+                first = math.floor((lon - lon_span + 180) / self.cell_size)
+                last = math.floor((lon + lon_span + 180) / self.cell_size)
+                columns = range(first, min(last, first + self.columns - 1) + 1)
+
+        lat_rad, lon_rad = math.radians(lat), math.radians(lon)
+        cos_lat = math.cos(lat_rad)
+        limit = math.sin(min(angle, math.pi) / 2) ** 2
+        found = []
+        for row in rows:
+            for column in columns:
+                for icao, station_lat, station_lon, station_cos in cells.get((row, column % self.columns), ()):
+                    half_chord = (
+                        math.sin((station_lat - lat_rad) / 2) ** 2
+                        + cos_lat * station_cos * math.sin((station_lon - lon_rad) / 2) ** 2
+                    )
+                    if half_chord <= limit:
+                        found.append((half_chord, icao))
+        found.sort()
+        return [icao for _, icao in found]
+
+
+async def load_station_index(index: StationIndex, db_icao: DB, db_meta: DB) -> bool:
+    """Load the station catalog into the index unless the loaded version is current, True if it was loaded"""
+    meta = await db_meta.get_document(CATALOG_VERSION_KEY)
+    version = meta["updated_at"] if meta else None
+    if index.ready and version == index.version:
+        return False
+    index.load(await db_icao.icao_catalog(), version)
+    logger.info(f"Station index loaded: {index.size} stations")
+    return True
+
+
+async def watch_station_catalog(index: StationIndex, db_icao: DB, db_meta: DB, interval: float) -> None:
+    """Reload the index whenever the station catalog version changes"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await load_station_index(index, db_icao, db_meta)
+        except Exception:
+            logger.exception("Station index refresh failed")
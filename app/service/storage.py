@@ -1,5 +1,8 @@
 from abc import ABC, abstractmethod
-from typing import Dict
+from typing import AsyncIterator, Dict, Optional
+
+from app.service.models import Geo, Id, Observation
+from app.service.pagination import PageRequest
 
 
 class StorageWrapper(ABC):
@@ -12,13 +15,59 @@ class StorageWrapper(ABC):
         pass
 
     @abstractmethod
-    async def timestamps_upload(self, timestamp_data: dict) -> None:
+    async def icao_sync(self, stations: Dict[str, dict]) -> Dict[str, int]:
+        pass
+
+    @abstractmethod
+    async def timestamps_upload(self, timestamp_data: Observation) -> None:
+        pass
+
+    @abstractmethod
+    async def timestamps_bulk_upload(self, timestamps: list[Observation]) -> list[Observation]:
+        pass
+
+    @abstractmethod
+    async def rollups_update(self, observations: list[Observation], since: int) -> None:
+        pass
+
+    @abstractmethod
+    async def rollup_query(
+        self, stations: list[str], first: int, last: int, granularity: int, metrics: list[str]
+    ) -> list[Dict]:
+        pass
+
+    @abstractmethod
+    async def stations_query(
+        self, stations: list[str], start: int, end: int, page: Optional[PageRequest] = None
+    ) -> list[Dict]:
+        pass
+
+    @abstractmethod
+    async def geo_query(self, query: Geo, page: Optional[PageRequest] = None) -> list[Dict]:
+        pass
+
+    @abstractmethod
+    async def id_query(self, query: Id, page: Optional[PageRequest] = None) -> list[Dict]:
+        pass
+
+    @abstractmethod
+    async def stations_within(self, latitude: float, longitude: float, radius: int) -> list[str]:
+        pass
+
+    @abstractmethod
+    async def aggregate_query(
+        self, stations: list[str], start: int, end: int, bucket: int, metrics: list[str]
+    ) -> list[Dict]:
+        pass
+
+    @abstractmethod
+    def iter_stations_query(self, stations: list[str], start: int, end: int) -> AsyncIterator[Dict]:
         pass
 
     @abstractmethod
-    async def geo_query(self, icao: dict) -> list[Dict]:
+    def iter_geo_query(self, query: Geo) -> AsyncIterator[Dict]:
         pass
 
     @abstractmethod
-    async def id_query(self, icao: dict) -> list[Dict]:
+    def iter_id_query(self, query: Id) -> AsyncIterator[Dict]:
         pass
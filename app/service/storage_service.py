@@ -1,39 +1,277 @@
 from app.service.storage import StorageWrapper
-from app.service.cache import CacheMiss, CacheWrapper
-from typing import Dict, Union
+from app.service.cache import CacheMiss, CacheStale, CacheWrapper, align_window, trim_window
+from app.service.models import Aggregate, Geo, Id, Observation, Query
+from app.service.spatial import StationIndex
+from app.service.aggregation import choose_rollup, finalize, merge_partials
+from app.service.rollups import RollupCoverage, rollup_cutoff
+from app.service.pagination import Page, PageRequest, paginate
+from app.service.profiling import span, traced
+from app.service.singleflight import SingleFlight
+from typing import AsyncIterator, Dict, Iterable, Optional, TypeVar
+import asyncio
+import dataclasses
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+_FILL_POLL = 0.05  # seconds between cache checks while another worker refills a key
+
+Q = TypeVar("Q", Id, Geo)
 
 
 class StorageService(object):
-    def __init__(self, storage: StorageWrapper, cache: CacheWrapper) -> None:
+    def __init__(
+        self,
+        storage: StorageWrapper,
+        cache: CacheWrapper,
+        stations: Optional[StationIndex] = None,
+        rollups: Iterable[int] = (),
+        coverage: Optional[RollupCoverage] = None,
+        cache_window: int = 0,
+        fill_wait: float = 0,
+    ) -> None:
         self.storage = storage
         self.cache = cache
+        self.stations = stations
+        self.rollups = sorted(rollups, reverse=True)
+        self.coverage = coverage or RollupCoverage()
+        self.cache_window = cache_window
+        self.fill_wait = fill_wait
+        self.flights = SingleFlight()
+        self._revalidations: set[asyncio.Task] = set()
+
+    def _aligned(self, query: Q) -> Q:
+        """The query with its time range aligned to the cache window"""
+        start, end = align_window(query.start, query.end, self.cache_window)
+        if (start, end) == (query.start, query.end):
+            return query
+        return dataclasses.replace(query, start=start, end=end)
 
     async def icao_upload(self, icao_data: dict) -> None:
         """Call storage db method icao_upload"""
         return await self.storage.icao_upload(icao_data=icao_data)
 
-    async def timestamps_upload(self, timestamp_data: Dict[str, Union[str, int, float]]) -> None:
+    async def icao_sync(self, stations: Dict[str, dict]) -> Dict[str, int]:
+        """Call storage db method icao_sync"""
+        return await self.storage.icao_sync(stations)
+
+    async def timestamps_upload(self, timestamp_data: Observation) -> None:
         """Call storage db method timestamps_upload"""
         return await self.storage.timestamps_upload(timestamp_data)
 
-    async def geo_query(self, icao: dict) -> list[Dict]:
-        """Check if geo query exists in cache else call database"""
+    async def timestamps_bulk_upload(self, timestamps: list[Observation]) -> list[Observation]:
+        """Call storage db method timestamps_bulk_upload"""
+        return await self.storage.timestamps_bulk_upload(timestamps)
+
+    async def rollups_update(self, observations: list[Observation], since: int) -> None:
+        """Call storage db method rollups_update"""
+        return await self.storage.rollups_update(observations, since)
+
+    @traced("StorageService.geo_query")
+    async def geo_query(self, query: Geo) -> list[Dict]:
+        """Check if geo query exists in cache else call database, both for the time range aligned to the cache window"""
+        geo_report = await self._cached(self._aligned(query))
+        return trim_window(geo_report, query.start, query.end)
+
+    def _radius_stations(self, query: Geo) -> Optional[list[str]]:
+        """Stations within the radius from the station index, None if the index is not loaded"""
+        if self.stations is None or not self.stations.ready:
+            return None
+        with span("StationIndex.within"):
+            return self.stations.within(query.lat, query.lon, query.radius)
+
+    async def _geo_query(self, query: Geo, page: Optional[PageRequest] = None) -> list[Dict]:
+        """Filter stations by radius in the station index if it is loaded, else leave it all to the database"""
+        return await self._geo_rows(query, self._radius_stations(query), page)
+
+    async def _geo_rows(
+        self, query: Geo, stations: Optional[list[str]], page: Optional[PageRequest] = None
+    ) -> list[Dict]:
+        """Rows of the geo query for the stations within its radius, None leaves the radius to the database"""
+        if stations is None:
+            return await self.storage.geo_query(query, page)
+        if not stations:
+            return []
+        return await self.storage.stations_query(stations, query.start, query.end, page)
+
+    async def _get_cached(self, query: Query) -> list[Dict]:
+        if isinstance(query, Id):
+            return await self.cache.get_id_query(query)
+        return await self.cache.get_geo_query(query)
+
+    @traced("StorageService.load")
+    async def _load(self, query: Query) -> list[Dict]:
+        """Load the report from the database and cache it"""
+        if isinstance(query, Id):
+            report = await self.storage.id_query(query)
+            await self.cache.set_id_query(query, report)
+        else:
+            stations = self._radius_stations(query)
+            report = await self._geo_rows(query, stations)
+            await self.cache.set_geo_query(query, report, stations)
+        return report
+
+    async def _cached(self, query: Query) -> list[Dict]:
+        """Cached report of the query, concurrent misses of the same query within the worker share one load"""
+        key = self.cache.query_key(query)
         try:
-            geo_report = await self.cache.get_geo_query(icao.copy())
-            return geo_report
+            return await self._get_cached(query)
+        except CacheStale as stale:
+            if key not in self.flights and ("revalidate", key) not in self.flights:
+                task = asyncio.create_task(self._revalidate(key, query))
+                self._revalidations.add(task)
+                task.add_done_callback(self._revalidated)
+            return stale.report
         except CacheMiss:
-            geo_report = await self.storage.geo_query(icao)
-            if len(geo_report) != 0:
-                await self.cache.set_geo_query(icao, geo_report)
-            return geo_report
+            return await self.flights.do(key, lambda: self._fill(key, query, wait=True))
+
+    async def _revalidate(self, key: str, query: Query) -> list[Dict]:
+        """Refill the key unless another worker does, a miss never joins it as it may give up without a report"""
+        return await self.flights.do(("revalidate", key), lambda: self._fill(key, query, wait=False))
+
+    def _revalidated(self, task: asyncio.Task) -> None:
+        self._revalidations.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Cache revalidation failed", exc_info=task.exception())
+
+    @traced("StorageService.fill")
+    async def _fill(self, key: str, query: Query, wait: bool) -> list[Dict]:
+        """Load the report and cache it, unless another worker holds the lease of the key.
 
-    async def id_query(self, icao: dict) -> list[Dict]:
-        """Check if id query exists in cache else call database"""
+        Without the lease a miss waits for the other worker to cache the report and only loads it itself on timeout,
+        a revalidation gives up at once.
+        """
+        token = await self.cache.acquire_lease(key)
+        if token is None:
+            if not wait:
+                return []
+            deadline = time.monotonic() + self.fill_wait
+            while time.monotonic() < deadline:
+                await asyncio.sleep(_FILL_POLL)
+                report = await self.cache.peek_query(query)
+                if report is not None:
+                    return report
         try:
-            id_report = await self.cache.get_id_query(icao.copy())
-            return id_report
-        except CacheMiss:
-            id_report = await self.storage.id_query(icao)
-            if len(id_report) != 0:
-                await self.cache.set_id_query(icao, id_report)
-            return id_report
+            return await self._load(query)
+        finally:
+            if token is not None:
+                await self.cache.release_lease(key, token)
+
+    async def warm(self, queries: list[Query]) -> int:
+        """Load the id and geo queries into the cache, returns the number of queries warmed"""
+        warmed = 0
+        for query in queries:
+            key = self.cache.query_key(query)
+            try:
+                await self._revalidate(key, query)
+            except Exception:
+                logger.exception(f"Warming {query} failed")
+                continue
+            warmed += 1
+        return warmed
+
+    @traced("StorageService.geo_query_page")
+    async def geo_query_page(self, query: Geo, page: PageRequest) -> Page:
+        """Get one page of the geo query straight from the database"""
+        rows = await self._geo_query(query, PageRequest(page.limit + 1, page.after))
+        return paginate(rows, page.limit)
+
+    async def iter_geo_query(self, query: Geo) -> AsyncIterator[Dict]:
+        """Iterate over the geo query rows as the database yields them"""
+        stations = self._radius_stations(query)
+        if stations is None:
+            rows = self.storage.iter_geo_query(query)
+        elif stations:
+            rows = self.storage.iter_stations_query(stations, query.start, query.end)
+        else:
+            return
+        async for row in rows:
+            yield row
+
+    @traced("StorageService.id_query")
+    async def id_query(self, query: Id) -> list[Dict]:
+        """Check if id query exists in cache else call database, both for the time range aligned to the cache window"""
+        id_report = await self._cached(self._aligned(query))
+        return trim_window(id_report, query.start, query.end)
+
+    @traced("StorageService.id_batch")
+    async def id_batch(self, queries: Iterable[Id]) -> Dict[str, list[Dict]]:
+        """Reports of many id queries grouped by station, for the time ranges aligned to the cache window.
+
+        Cached reports are read at once, the missing ones are loaded with one database query per time range.
+        """
+        aligned = {query: self._aligned(query) for query in queries}
+        unique = list(dict.fromkeys(aligned.values()))
+        reports = await self.cache.get_id_queries(unique)
+        misses: Dict[tuple[int, int], list[Id]] = {}
+        for query in unique:
+            if query not in reports:
+                misses.setdefault((query.start, query.end), []).append(query)
+        for (start, end), missing in misses.items():
+            reports.update(await self._load_stations(missing, start, end))
+        return {query.icao: trim_window(reports[aligned[query]], query.start, query.end) for query in aligned}
+
+    async def _load_stations(self, queries: list[Id], start: int, end: int) -> Dict[Id, list[Dict]]:
+        """Load the reports of id queries of one time range from the database and cache them"""
+        grouped: Dict[str, list[Dict]] = {query.icao: [] for query in queries}
+        for row in await self.storage.stations_query(list(grouped), start, end):
+            grouped[row["icao"]].append(row)
+        reports = {query: grouped[query.icao] for query in queries}
+        await self.cache.set_id_queries(reports)
+        return reports
+
+    @traced("StorageService.id_query_page")
+    async def id_query_page(self, query: Id, page: PageRequest) -> Page:
+        """Get one page of the id query straight from the database"""
+        rows = await self.storage.id_query(query, PageRequest(page.limit + 1, page.after))
+        return paginate(rows, page.limit)
+
+    def iter_id_query(self, query: Id) -> AsyncIterator[Dict]:
+        """Iterate over the id query rows as the database yields them"""
+        return self.storage.iter_id_query(query)
+
+    @traced("StorageService.id_aggregate")
+    async def id_aggregate(self, query: Id, aggregate: Aggregate) -> list[Dict]:
+        """Bucketed statistics of one station computed by the database"""
+        return await self._aggregate([query.icao], query.start, query.end, aggregate)
+
+    @traced("StorageService.geo_aggregate")
+    async def geo_aggregate(self, query: Geo, aggregate: Aggregate) -> list[Dict]:
+        """Bucketed statistics of every station within the radius computed by the database"""
+        stations = self._radius_stations(query)
+        if stations is None:
+            stations = await self.storage.stations_within(query.lat, query.lon, query.radius)
+        if not stations:
+            return []
+        return await self._aggregate(stations, query.start, query.end, aggregate)
+
+    async def _aggregate(self, stations: list[str], start: int, end: int, aggregate: Aggregate) -> list[Dict]:
+        bucket = aggregate.bucket
+        metrics = list(aggregate.metrics)
+        statistics = list(aggregate.statistics)
+
+        granularity = choose_rollup(bucket, start, end, self.rollups)
+        spans: list[tuple[int, int, bool]] = []
+        if granularity is not None:
+            first = -(-start // granularity) * granularity
+            stop = (end + 1) // granularity * granularity
+            spans = self.coverage.spans(first, stop, granularity, rollup_cutoff())
+        if granularity is None or not any(covered for _, _, covered in spans):
+            partials = await self.storage.aggregate_query(stations, start, end, bucket, metrics)
+            return finalize(partials, metrics, statistics)
+
+        # Whole rollup buckets the rollup covers come from the rollup, the rest from raw reports
+        partials = []
+        for first_bucket, stop_bucket, covered in spans:
+            if covered:
+                last = stop_bucket - granularity
+                partials += await self.storage.rollup_query(stations, first_bucket, last, granularity, metrics)
+            else:
+                last = stop_bucket - 1
+                partials += await self.storage.aggregate_query(stations, first_bucket, last, granularity, metrics)
+        if start < first:
+            partials += await self.storage.aggregate_query(stations, start, first - 1, granularity, metrics)
+        if stop <= end:
+            partials += await self.storage.aggregate_query(stations, stop, end, granularity, metrics)
+        return finalize(merge_partials(partials, bucket, metrics), metrics, statistics)
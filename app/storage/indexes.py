@@ -0,0 +1,68 @@
+"""Index bootstrap and index usage report.
+
+Indexes are ensured on API and Celery worker start. The report is printed by
+
+    python -m app.storage.indexes
+"""
+import asyncio
+import logging
+from typing import Any, Dict
+
+from app.cfg import config
+from app.storage.mongo_client import DB, get_db
+
+logger = logging.getLogger(__name__)
+
+
+async def ensure_indexes(db_icao: DB, db_weather_data: DB) -> None:
+    """Create the indexes the hot queries rely on, existing indexes are left as they are"""
+    await db_icao.ensure_icao_index()
+    await db_icao.ensure_geo_index()
+    await db_weather_data.ensure_timestamps_index()
+    for collection in config.mongo.rollups.values():
+        await get_db(collection).ensure_rollup_index()
+    if config.mongo.observations_ttl:
+        await db_weather_data.ensure_ttl_index("observed_at", config.mongo.observations_ttl)
+
+
+def _plan_stages(plan: Dict[str, Any]) -> list[str]:
+    """Flatten the stages of a query plan"""
+    stages = [plan.get("stage", "")]
+    for child in plan.get("inputStages", []) + [plan[key] for key in ("inputStage", "queryPlan") if key in plan]:
+        stages.extend(_plan_stages(child))
+    return stages
+
+
+async def index_report(db_icao: DB, db_weather_data: DB) -> Dict[str, Any]:
+    """Winning plan stages of the hot queries and the access counters of every index"""
+    id_plan = await db_weather_data.collection.find({"icao": "KORD", "date": {"$gte": 0, "$lte": 1}}).explain()
+    geo_plan = await db_icao.collection.find(
+        {"location": {"$near": {"$geometry": {"type": "Point", "coordinates": [0, 0]}, "$maxDistance": 1}}}
+    ).explain()
+    report: Dict[str, Any] = {
+        "plans": {
+            "id_query": _plan_stages(id_plan["queryPlanner"]["winningPlan"]),
+            "geo_stations": _plan_stages(geo_plan["queryPlanner"]["winningPlan"]),
+        },
+        "usage": {},
+    }
+    for db in (db_icao, db_weather_data):
+        async for stats in db.collection.aggregate([{"$indexStats": {}}]):
+            report["usage"][f"{db.collection.name}.{stats['name']}"] = stats["accesses"]["ops"]
+    return report
+
+
+async def main() -> None:
+    db_icao = get_db(config.mongo.collection_icao)
+    db_weather_data = get_db(config.mongo.collection_weather_data)
+    await ensure_indexes(db_icao, db_weather_data)
+    report = await index_report(db_icao, db_weather_data)
+    for query, stages in report["plans"].items():
+        level = logging.WARNING if "COLLSCAN" in stages else logging.INFO
+        logger.log(level, f"{query}: {' <- '.join(stages)}")
+    for index, ops in report["usage"].items():
+        logger.info(f"{index}: {ops} accesses")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,81 @@
+"""Data migrations of the weather data collection.
+
+    python -m app.storage.migrations [numeric|rollups|observed_at]
+"""
+import asyncio
+import logging
+import sys
+
+from app.cfg import config
+from app.service.rollups import mark_rollups_rebuilt, rollup_cutoff, rollups_rebuilt_until
+from app.storage.mongo_client import DB, get_db, partials_pipeline
+
+logger = logging.getLogger(__name__)
+
+NUMERIC_FIELDS = {"temperature": "double", "pressure": "int", "wind_direction": "int", "wind_speed": "int"}
+
+
+async def migrate_observations_to_numeric(db: DB) -> int:
+    """Convert string observation fields to numbers and empty strings to null, returns the number of documents changed
+
+    Runs as a single server-side pipeline update, documents that are already numeric are not touched.
+    """
+    query = {"$or": [{field: {"$type": "string"}} for field in NUMERIC_FIELDS]}
+    update = [
+        {
+            "$set": {
+                field: {"$convert": {"input": f"${field}", "to": to, "onError": None, "onNull": None}}
+                for field, to in NUMERIC_FIELDS.items()
+            }
+        }
+    ]
+    result = await db.collection.update_many(query, update)
+    return result.modified_count
+
+
+async def backfill_observed_at(db: DB) -> int:
+    """Add the expiry date field to the observations stored without one, returns the number of documents changed
+
+    Observations stored while OBSERVATIONS_TTL was unset have no observed_at, the TTL index would never expire them.
+    """
+    update = [{"$set": {"observed_at": {"$toDate": {"$multiply": [{"$toLong": "$date"}, 1000]}}}}]
+    result = await db.collection.update_many({"observed_at": {"$exists": False}}, update)
+    return result.modified_count
+
+
+async def rebuild_rollups(db: DB, db_meta: DB, full: bool = True) -> None:
+    """Recompute the rollups from the weather data, replacing the rollup buckets that exist
+
+    Rollups are updated on ingest after the reports are stored, this backfills them and repairs
+    buckets that missed an update. Only reports older than the rollup cutoff are rebuilt: the ingest
+    skips those, so the rebuild cannot overwrite or double an increment of a concurrent ingest.
+    Unless full, only the reports that settled since the last rebuild are recomputed.
+    """
+    since = None if full else await rollups_rebuilt_until(db_meta)
+    until = rollup_cutoff()
+    dates = {"$lt": until} if since is None else {"$gte": since, "$lt": until}
+    for granularity, collection in config.mongo.rollups.items():
+        pipeline = [
+            {"$match": {"date": dates}},
+            *partials_pipeline(granularity, dates=True),
+            {"$merge": {"into": collection, "on": ["icao", "bucket"]}},
+        ]
+        await db.collection.aggregate(pipeline, allowDiskUse=True).to_list(None)
+        logger.info(f"Rebuilt rollup {collection}")
+    await mark_rollups_rebuilt(db_meta, until)
+
+
+async def main(migration: str) -> None:
+    db_weather_data = get_db(config.mongo.collection_weather_data)
+    if migration == "rollups":
+        await rebuild_rollups(db_weather_data, get_db(config.mongo.collection_meta))
+    elif migration == "observed_at":
+        modified = await backfill_observed_at(db_weather_data)
+        logger.info(f"Added observed_at to {modified} observations")
+    else:
+        modified = await migrate_observations_to_numeric(db_weather_data)
+        logger.info(f"Converted {modified} observations to numeric fields")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1] if len(sys.argv) > 1 else "numeric"))
@@ -1,24 +1,82 @@
-from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase  # type: ignore
+from motor.motor_asyncio import (  # type: ignore
+    AsyncIOMotorClient,
+    AsyncIOMotorCommandCursor,
+    AsyncIOMotorCursor,
+    AsyncIOMotorDatabase,
+)
+from pymongo import ASCENDING, GEOSPHERE, DeleteMany, InsertOne, UpdateOne  # type: ignore
+from pymongo.errors import BulkWriteError, OperationFailure  # type: ignore
 import asyncio
+import time
+from datetime import datetime, timezone
 from abc import ABC
 
+from app.service.models import OBSERVATION_FIELDS, Geo, Id, Observation
+from app.service.aggregation import METRICS, partials_of
+from app.service.metrics import MONGO_QUERY_SECONDS, MONGO_ROWS
+from app.service.pagination import PageRequest
+from app.service.profiling import span
 from app.service.storage import StorageWrapper
-from typing import Dict
+from typing import Any, AsyncIterator, Dict, Iterable, Optional, Tuple
 from app.cfg import config
 
 
 class MongoClient:
     """An object for establishing connection with a database on a mongodb-server."""
 
-    def __init__(self, uri: str, db: str):
-        self._client: AsyncIOMotorClient = AsyncIOMotorClient(uri)
+    def __init__(self, uri: str, db: str, **options: Any):
+        self._client: AsyncIOMotorClient = AsyncIOMotorClient(uri, **options)
         self._client.get_io_loop = asyncio.get_event_loop
         self.db: AsyncIOMotorDatabase = self._client[db]
 
-    def __del__(self) -> None:
+    def close(self) -> None:
         self._client.close()
 
 
+# One client, and therefore one connection pool, per database within a process
+_mongo_clients: Dict[Tuple[str, str], MongoClient] = {}
+
+
+REPORT_PROJECTION = {"_id": 0, **{field: 1 for field in OBSERVATION_FIELDS}}
+
+
+def observation_document(observation: Observation) -> dict:
+    """Storage document of an observation, with the BSON date the observations TTL index expires it by"""
+    document = observation.to_document()
+    # Written even without a TTL so that enabling one later also expires the reports stored before
+    document["observed_at"] = datetime.fromtimestamp(observation.date, tz=timezone.utc)
+    return document
+
+
+async def read_all(name: str, cursor: AsyncIOMotorCursor | AsyncIOMotorCommandCursor) -> list[Dict]:
+    """Every row of the cursor, recording the query time and row count under name"""
+    started = time.perf_counter()
+    with span(f"DB.{name}"):
+        rows = await cursor.to_list(None)
+    MONGO_QUERY_SECONDS.labels(name).observe(time.perf_counter() - started)
+    MONGO_ROWS.labels(name).observe(len(rows))
+    return rows
+
+
+def partials_pipeline(bucket: int, metrics: Iterable[str] = METRICS, dates: bool = False) -> list[Dict]:
+    """Aggregation stages grouping reports into partial statistics per station and bucket, with their dates if asked"""
+    group: dict = {
+        "_id": {"icao": "$icao", "bucket": {"$subtract": ["$date", {"$mod": ["$date", bucket]}]}},
+        "count": {"$sum": 1},
+    }
+    project: dict = {"_id": 0, "icao": "$_id.icao", "bucket": "$_id.bucket", "count": 1}
+    if dates:
+        group["dates"] = {"$push": "$date"}
+        project["dates"] = 1
+    for metric in metrics:
+        group[f"{metric}_n"] = {"$sum": {"$cond": [{"$isNumber": f"${metric}"}, 1, 0]}}
+        group[f"{metric}_sum"] = {"$sum": f"${metric}"}
+        group[f"{metric}_min"] = {"$min": f"${metric}"}
+        group[f"{metric}_max"] = {"$max": f"${metric}"}
+        project[metric] = {stat: f"${metric}_{stat}" for stat in ("n", "sum", "min", "max")}
+    return [{"$group": group}, {"$sort": {"_id.icao": ASCENDING, "_id.bucket": ASCENDING}}, {"$project": project}]
+
+
 class DB(StorageWrapper, ABC):
     """Database management client connected to a certain collection within one database.
 
@@ -28,82 +86,285 @@ class DB(StorageWrapper, ABC):
     def __init__(self, db: AsyncIOMotorDatabase, collection_name: str) -> None:
         self.collection = db[collection_name]
 
+    async def ensure_icao_index(self) -> None:
+        """Create the unique icao index the station catalog is keyed on"""
+        await self.collection.create_index("icao", unique=True)
+
     async def icao_upload(self, icao_data: dict) -> None:
         """Upload icao data to database, if it is not in database"""
-        is_exist = await self.collection.count_documents({"icao": icao_data["icao"]}) != 0
-        if not is_exist:
-            await self.collection.insert_one(icao_data)
-
-    async def timestamps_upload(self, timestamp_data: dict) -> None:
-        """Upload weather data to database"""
-        icao_name = timestamp_data["icao"]
-        date = timestamp_data["date"]
-        is_exist = await self.collection.count_documents({"$and": [{"icao": icao_name}, {"date": date}]}) != 0
-        if not is_exist:
-            await self.collection.insert_one(timestamp_data)
-
-    async def id_query(self, icao: dict) -> list[Dict]:
-        icao_name = str(*icao["icao"])
-        start = int(*icao["start"])
-        end = int(*icao["end"])
-
-        cursor = self.collection.find({"$and": [{"icao": icao_name}, {"date": {"$gte": start, "$lte": end}}]})
-
-        report_to_return = []
-        async for doc in cursor:
-            report = {
-                "icao": doc["icao"],
-                "date": doc["date"],
-                "temperature": doc["temperature"],
-                "pressure": doc["pressure"],
-                "wind_direction": doc["wind_direction"],
-                "wind_speed": doc["wind_speed"],
-            }
-            report_to_return.append(report)
-        return report_to_return
+        await self.collection.update_one({"icao": icao_data["icao"]}, {"$setOnInsert": icao_data}, upsert=True)
+
+    async def icao_catalog(self) -> list[dict]:
+        """Get icao and location of every station"""
+        return await self.collection.find({}, {"_id": 0, "icao": 1, "location": 1}).to_list(None)
+
+    async def icao_sync(self, stations: Dict[str, dict]) -> Dict[str, int]:
+        """Make the station catalog match stations with one bulk write.
+
+        Returns the number of added, changed and removed stations.
+        """
+        cursor = self.collection.find({}, {"_id": 0, "icao": 1, "location": 1})
+        stored = {doc["icao"]: doc["location"] async for doc in cursor}
+        operations: list = []
+        counts = {"added": 0, "changed": 0, "removed": 0}
+        for icao, station in stations.items():
+            location = stored.get(icao)
+            if location is None:
+                operations.append(InsertOne(station))
+                counts["added"] += 1
+            elif location != station["location"]:
+                operations.append(UpdateOne({"icao": icao}, {"$set": {"location": station["location"]}}))
+                counts["changed"] += 1
+        # An empty catalog means a broken download, never wipe the stored one because of it
+        removed = [icao for icao in stored if icao not in stations] if stations else []
+        if removed:
+            operations.append(DeleteMany({"icao": {"$in": removed}}))
+            counts["removed"] = len(removed)
+        if operations:
+            await self.collection.bulk_write(operations, ordered=False)
+        return counts
+
+    async def get_document(self, key: str) -> Optional[dict]:
+        """Get a keyed document of the collection without its key"""
+        return await self.collection.find_one({"_id": key}, {"_id": 0})
+
+    async def set_document(self, key: str, document: dict) -> None:
+        """Create or replace a keyed document of the collection"""
+        await self.collection.replace_one({"_id": key}, document, upsert=True)
+
+    async def update_document(self, key: str, update: dict) -> None:
+        """Apply update operators to a keyed document of the collection, creating it if missing"""
+        await self.collection.update_one({"_id": key}, update, upsert=True)
+
+    async def watermarks_get(self) -> Dict[str, int]:
+        """Get the last harvested report mtime of every station"""
+        return {doc["_id"]: doc["mtime"] async for doc in self.collection.find({}, {"mtime": 1})}
+
+    async def watermarks_update(self, watermarks: Dict[str, int]) -> None:
+        """Move station watermarks forward, a watermark never goes back in time"""
+        if not watermarks:
+            return
+        operations = [
+            UpdateOne({"_id": icao}, {"$max": {"mtime": mtime}}, upsert=True) for icao, mtime in watermarks.items()
+        ]
+        await self.collection.bulk_write(operations, ordered=False)
+
+    async def ensure_timestamps_index(self) -> None:
+        """Create the unique (icao, date) index the weather data upserts and queries are keyed on"""
+        await self.collection.create_index([("icao", ASCENDING), ("date", ASCENDING)], unique=True)
+
+    async def ensure_geo_index(self) -> None:
+        """Create the 2dsphere index radius queries on station locations need"""
+        await self.collection.create_index([("location", GEOSPHERE)])
+
+    async def ensure_rollup_index(self) -> None:
+        """Create the unique (icao, bucket) index rollup updates are keyed on"""
+        await self.collection.create_index([("icao", ASCENDING), ("bucket", ASCENDING)], unique=True)
+
+    async def ensure_ttl_index(self, field: str, expire_after: int) -> None:
+        """Create a TTL index on field, or change the expiry of the existing one"""
+        try:
+            await self.collection.create_index(field, expireAfterSeconds=expire_after)
+        except OperationFailure as exc:
+            if exc.code != 85:  # IndexOptionsConflict
+                raise
+            await self.collection.database.command(
+                "collMod", self.collection.name, index={"keyPattern": {field: 1}, "expireAfterSeconds": expire_after}
+            )
+
+    async def timestamps_upload(self, timestamp_data: Observation) -> None:
+        """Upload weather data to database, if it is not in database"""
+        await self.collection.update_one(
+            {"icao": timestamp_data.icao, "date": timestamp_data.date},
+            {"$setOnInsert": observation_document(timestamp_data)},
+            upsert=True,
+        )
+
+    async def timestamps_bulk_upload(self, timestamps: list[Observation]) -> list[Observation]:
+        """Upload many weather reports with one unordered bulk write, returns the reports that were new"""
+        if not timestamps:
+            return []
+        operations = [
+            UpdateOne({"icao": item.icao, "date": item.date}, {"$setOnInsert": observation_document(item)}, upsert=True)
+            for item in timestamps
+        ]
+        try:
+            result = await self.collection.bulk_write(operations, ordered=False)
+        except BulkWriteError as exc:
+            # Concurrent upserts of the same report lose the race on the unique index, the report is stored anyway
+            if any(error["code"] != 11000 for error in exc.details["writeErrors"]):
+                raise
+            return [timestamps[upserted["index"]] for upserted in exc.details["upserted"]]
+        return [timestamps[index] for index in result.upserted_ids]
+
+    async def rollups_update(self, observations: list[Observation], since: int) -> None:
+        """Add reports to the hourly and daily rollups, a report that was already added is skipped
+
+        Every rollup bucket keeps the dates of its reports, so that the reports of a batch can be added again
+        after a failure. Reports dated before since are skipped, their buckets are recomputed by the next rollup
+        rebuild.
+        """
+        observations = [observation for observation in observations if observation.date >= since]
+        for granularity, collection_name in config.mongo.rollups.items():
+            operations = []
+            for observation in observations:
+                partial = partials_of([observation], granularity)[0]
+                increments = {"count": 1}
+                minimums, maximums = {}, {}
+                for metric in METRICS:
+                    values = partial[metric]
+                    increments[f"{metric}.n"] = values["n"]
+                    increments[f"{metric}.sum"] = values["sum"]
+                    if values["n"]:
+                        minimums[f"{metric}.min"] = values["min"]
+                        maximums[f"{metric}.max"] = values["max"]
+                update: dict = {"$inc": increments, "$push": {"dates": observation.date}}
+                if minimums:
+                    update.update({"$min": minimums, "$max": maximums})
+                # A bucket that already has the report does not match, its upsert fails on the unique index
+                key = {"icao": partial["icao"], "bucket": partial["bucket"], "dates": {"$ne": observation.date}}
+                operations.append(UpdateOne(key, update, upsert=True))
+            if not operations:
+                continue
+            try:
+                await self.collection.database[collection_name].bulk_write(operations, ordered=False)
+            except BulkWriteError as exc:
+                if any(error["code"] != 11000 for error in exc.details["writeErrors"]):
+                    raise
+
+    async def rollup_query(
+        self, stations: list[str], first: int, last: int, granularity: int, metrics: list[str]
+    ) -> list[Dict]:
+        """Get partial statistics of the stations from the rollup of granularity, for buckets first to last"""
+        collection = self.collection.database[config.mongo.rollups[granularity]]
+        query = {"icao": {"$in": stations}, "bucket": {"$gte": first, "$lte": last}}
+        projection = {"_id": 0, "icao": 1, "bucket": 1, "count": 1, **{metric: 1 for metric in metrics}}
+        return await read_all("rollup", collection.find(query, projection, batch_size=config.mongo.batch_size))
 
     @staticmethod
-    async def geo_radius_filter(longitude: float, latitude: float, radius: int) -> list[dict]:
+    def _paged(query: dict, page: Optional[PageRequest]) -> dict:
+        """Add the continuation condition of the page to a query"""
+        if page is None or page.after is None:
+            return query
+        date, icao_name = page.after
+        return {"$and": [query, {"$or": [{"date": {"$gt": date}}, {"date": date, "icao": {"$gt": icao_name}}]}]}
+
+    def _find(self, query: dict, page: Optional[PageRequest]) -> AsyncIOMotorCursor:
+        cursor = self.collection.find(self._paged(query, page), REPORT_PROJECTION, batch_size=config.mongo.batch_size)
+        if page is not None:
+            cursor = cursor.sort([("date", ASCENDING), ("icao", ASCENDING)]).limit(page.limit)
+        return cursor
+
+    def _id_cursor(self, query: Id, page: Optional[PageRequest]) -> AsyncIOMotorCursor:
+        return self._find({"icao": query.icao, "date": {"$gte": query.start, "$lte": query.end}}, page)
+
+    def _stations_cursor(
+        self, stations: list[str], start: int, end: int, page: Optional[PageRequest]
+    ) -> AsyncIOMotorCursor:
+        return self._find({"icao": {"$in": stations}, "date": {"$gte": start, "$lte": end}}, page)
+
+    def _geo_cursor(self, query: Geo, page: Optional[PageRequest]) -> AsyncIOMotorCommandCursor:
+        """One aggregation on the station catalog: $geoNear picks the stations in the radius
+        and $lookup joins their reports of the time range on the (icao, date) index. Needs MongoDB 5.0+.
+        """
+        collection_icao = self.collection.database[config.mongo.collection_icao]
+        pipeline: list[dict] = [
+            {
+                "$geoNear": {
+                    "near": {"type": "Point", "coordinates": [query.lon, query.lat]},
+                    "key": "location",
+                    "distanceField": "distance",
+                    "maxDistance": query.radius,
+                    "spherical": True,
+                }
+            },
+            {"$project": {"_id": 0, "icao": 1}},
+            {
+                "$lookup": {
+                    "from": self.collection.name,
+                    "localField": "icao",
+                    "foreignField": "icao",
+                    "pipeline": [
+                        {"$match": {"date": {"$gte": query.start, "$lte": query.end}}},
+                        {"$project": REPORT_PROJECTION},
+                    ],
+                    "as": "reports",
+                }
+            },
+            {"$unwind": "$reports"},
+            {"$replaceRoot": {"newRoot": "$reports"}},
+        ]
+        if page is not None:
+            pipeline += [
+                {"$match": self._paged({}, page)},
+                {"$sort": {"date": ASCENDING, "icao": ASCENDING}},
+                {"$limit": page.limit},
+            ]
+        return collection_icao.aggregate(pipeline, batchSize=config.mongo.batch_size, allowDiskUse=True)
+
+    async def id_query(self, query: Id, page: Optional[PageRequest] = None) -> list[Dict]:
+        """Find weather data of one station within the time range, only the response fields are fetched"""
+        return await read_all("id", self._id_cursor(query, page))
+
+    async def stations_query(
+        self, stations: list[str], start: int, end: int, page: Optional[PageRequest] = None
+    ) -> list[Dict]:
+        """Find weather data of the stations within the time range"""
+        return await read_all("stations", self._stations_cursor(stations, start, end, page))
+
+    async def geo_query(self, query: Geo, page: Optional[PageRequest] = None) -> list[Dict]:
+        """Filter by date and radius and find weather data at DB"""
+        return await read_all("geo", self._geo_cursor(query, page))
+
+    async def stations_within(self, latitude: float, longitude: float, radius: int) -> list[str]:
         """Get the list of ICAO in request radius"""
-        collection_icao = get_db(config.mongo.collection_icao).collection
+        collection_icao = self.collection.database[config.mongo.collection_icao]
         radius_query = {
             "location": {
                 "$near": {"$geometry": {"type": "Point", "coordinates": [longitude, latitude]}, "$maxDistance": radius}
             },
         }
-        return [doc["icao"] async for doc in collection_icao.find(radius_query)]
+        stations = await read_all("within", collection_icao.find(radius_query, {"_id": 0, "icao": 1}))
+        return [doc["icao"] for doc in stations]
 
-    async def geo_query(self, icao: dict) -> list[Dict]:
-        """Filter by date and radius and find weather data at DB"""
-        lat = float(*icao["lat"])
-        lon = float(*icao["lon"])
-        radius = int(*icao["radius"])
-        start = int(*icao["start"])
-        end = int(*icao["end"])
+    async def aggregate_query(
+        self, stations: list[str], start: int, end: int, bucket: int, metrics: list[str]
+    ) -> list[Dict]:
+        """Group reports of the stations within the time range into partial statistics per station and bucket"""
+        pipeline = [
+            {"$match": {"icao": {"$in": stations}, "date": {"$gte": start, "$lte": end}}},
+            *partials_pipeline(bucket, metrics),
+        ]
+        return await read_all("aggregate", self.collection.aggregate(pipeline, batchSize=config.mongo.batch_size))
 
-        radius_filtered = await self.geo_radius_filter(lon, lat, radius)
+    def iter_id_query(self, query: Id) -> AsyncIterator[Dict]:
+        """Iterate over weather data of one station as the cursor yields it"""
+        return self._id_cursor(query, None)
 
-        time_filtered = self.collection.find(
-            {"$and": [{"icao": {"$in": radius_filtered}}, {"date": {"$gte": start, "$lte": end}}]}
-        )
+    def iter_stations_query(self, stations: list[str], start: int, end: int) -> AsyncIterator[Dict]:
+        """Iterate over weather data of the stations as the cursor yields it"""
+        return self._stations_cursor(stations, start, end, None)
 
-        report_to_return = []
-        async for doc in time_filtered:
-            report = {
-                "icao": doc["icao"],
-                "date": doc["date"],
-                "temperature": doc["temperature"],
-                "pressure": doc["pressure"],
-                "wind_direction": doc["wind_direction"],
-                "wind_speed": doc["wind_speed"],
-            }
-            report_to_return.append(report)
-        return report_to_return
+    def iter_geo_query(self, query: Geo) -> AsyncIterator[Dict]:
+        """Iterate over weather data within the radius as the cursor yields it"""
+        return self._geo_cursor(query, None)
 
 
 def get_mongo_client() -> MongoClient:
-    """Get MongoClient instance."""
-    return MongoClient(uri=config.mongo.uri, db=config.mongo.db)
+    """Get the MongoClient instance shared within the process."""
+    key = (config.mongo.uri, config.mongo.db)
+    client = _mongo_clients.get(key)
+    if client is None:
+        client = MongoClient(uri=config.mongo.uri, db=config.mongo.db, **config.mongo.client_options)
+        _mongo_clients[key] = client
+    return client
+
+
+def close_mongo_clients() -> None:
+    """Close the shared MongoClient instances, the next get_mongo_client call opens a new one."""
+    while _mongo_clients:
+        _, client = _mongo_clients.popitem()
+        client.close()
 
 
 def get_db(collection: str, db_client: MongoClient = None) -> DB:
@@ -0,0 +1,100 @@
+"""Micro-benchmark of the decoded METAR report parser.
+
+Compares app.service.get_data.metar against the previous ProcessStationData implementation
+(strptime + mktime and uncompiled regular expressions per line).
+
+    python -m benchmarks.bench_metar_parser [reports]
+"""
+import re
+import sys
+import time
+from datetime import datetime as dt
+from typing import Callable
+
+from app.service.get_data.metar import parse_decoded_report, parse_decoded_reports
+
+REPORTS = [
+    """Chicago O'Hare International Airport, IL, United States (KORD) 41-59N 087-54W 201M
+Oct 18, 2022 - 10:51 AM EDT / 2022.10.18 1451 UTC
+Wind: from the W (270 degrees) at 12 MPH (10 KT) gusting to 25 MPH (22 KT):0
+Visibility: 10 mile(s):0
+Sky conditions: mostly cloudy
+Temperature: 55.9 F (13.3 C)
+Dew Point: 39.9 F (4.4 C)
+Relative Humidity: 54%
+Pressure (altimeter): 30.05 in. Hg (1017 hPa)
+ob: KORD 181451Z 27010G22KT 10SM BKN045 13/04 A3005 RMK AO2 SLP176 T01330044 51011
+cycle: 15
+""",
+    """Barrow / W. Post-W. Rogers Airport, AK, United States (PABR) 71-17N 156-46W 12M
+Oct 18, 2022 - 05:53 AM AKDT / 2022.10.18 1353 UTC
+Wind: Calm:0
+Visibility: 2 mile(s):0
+Sky conditions: overcast
+Weather: light snow; mist
+Temperature: 27.0 F (-2.8 C)
+Dew Point: 24.1 F (-4.4 C)
+Relative Humidity: 88%
+Pressure (altimeter): 29.74 in. Hg (1007 hPa)
+ob: PABR 181353Z 00000KT 2SM -SN BR OVC008 M03/M04 A2974 RMK AO2 SLP070 P0000 T10281044
+cycle: 14
+""",
+]
+
+
+def legacy_parse(station_data: str, icao: str) -> dict:
+    """The parser as it was before the precompiled single-pass rewrite"""
+    station_dict: dict = {
+        "icao": icao,
+        "date": "",
+        "temperature": "",
+        "pressure": "",
+        "wind_direction": "",
+        "wind_speed": "",
+    }
+
+    station_data_arr = station_data.split("\n")
+    data_collection_time = station_data_arr[1].split("/ ")[1]
+    station_dict["date"] = int(time.mktime(dt.strptime(data_collection_time, "%Y.%m.%d %H%M UTC").timetuple()))
+    for item in station_data_arr:
+        if item.startswith("Temperature"):
+            temp_data = re.search(r"(\d*\.|)\d* C", item)
+            if temp_data is not None:
+                station_dict["temperature"] = temp_data.group().split()[0]
+        elif item.startswith("Pressure"):
+            pressure_data = re.search(r"(-|)\d* hPa", item)
+            if pressure_data is not None:
+                station_dict["pressure"] = pressure_data.group().split()[0]
+        elif item.startswith("Wind:"):
+            if "Calm" in item:
+                station_dict["wind_speed"] = "0"
+            else:
+                wind_direction_data = re.search(r"\d* degrees", item)
+                wind_speed_data = re.search(r"\d* KT", item)
+                if wind_direction_data is not None:
+                    station_dict["wind_direction"] = wind_direction_data.group().split()[0].lstrip("0")
+                if wind_speed_data is not None:
+                    station_dict["wind_speed"] = wind_speed_data.group().split()[0]
+    return station_dict
+
+
+def measure(name: str, func: Callable[[], object], count: int) -> float:
+    started = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - started
+    rate = count / elapsed
+    print(f"{name:<28} {rate:>12,.0f} reports/s  {elapsed / count * 1e6:>8.2f} us/report")
+    return rate
+
+
+def main(count: int = 100_000) -> None:
+    pairs = [(f"K{i:03d}", REPORTS[i % len(REPORTS)]) for i in range(count)]
+
+    legacy = measure("legacy ProcessStationData", lambda: [legacy_parse(r, icao) for icao, r in pairs], count)
+    single = measure("parse_decoded_report", lambda: [parse_decoded_report(r, icao) for icao, r in pairs], count)
+    batch = measure("parse_decoded_reports", lambda: parse_decoded_reports(pairs), count)
+    print(f"speed-up: {single / legacy:.1f}x single, {batch / legacy:.1f}x batch")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
@@ -0,0 +1,69 @@
+"""Per-row cost of turning a 10k-row /id or /geo time range into a response body.
+
+Compares the previous path (full documents with _id decoded by the driver, a new dict built per document,
+Sanic json()) with the projected path (only the six response fields cross the wire and are decoded,
+rows are serialized as they come from the cursor). Sanic serializes with ujson in both cases.
+
+    python -m benchmarks.bench_query_rows [rows]
+"""
+import random
+import sys
+import time
+from typing import Callable
+
+import bson  # type: ignore
+import ujson  # type: ignore
+
+from app.service.models import OBSERVATION_FIELDS
+
+
+def documents(count: int) -> list[dict]:
+    random.seed(0)
+    return [
+        {
+            "_id": bson.ObjectId(),
+            "icao": f"K{i % 500:03d}",
+            "date": 1666000000 + i * 60,
+            "temperature": round(random.uniform(-30, 40), 1),
+            "pressure": random.randint(980, 1040),
+            "wind_direction": random.randint(0, 359),
+            "wind_speed": random.randint(0, 40),
+        }
+        for i in range(count)
+    ]
+
+
+def measure(name: str, func: Callable[[], object], rows: int, repeat: int = 20) -> float:
+    best = min(_timed(func) for _ in range(repeat))
+    print(f"{name:<36} {best * 1e3:>8.2f} ms  {best / rows * 1e9:>8.0f} ns/row")
+    return best
+
+
+def _timed(func: Callable[[], object]) -> float:
+    started = time.perf_counter()
+    func()
+    return time.perf_counter() - started
+
+
+def main(rows: int = 10_000) -> None:
+    docs = documents(rows)
+    full_wire = b"".join(bson.encode(doc) for doc in docs)
+    projected_wire = b"".join(bson.encode({field: doc[field] for field in OBSERVATION_FIELDS}) for doc in docs)
+    print(f"wire size: {len(full_wire) / rows:.0f} B/row full, {len(projected_wire) / rows:.0f} B/row projected")
+
+    def legacy() -> bytes:
+        reports = []
+        for doc in bson.decode_all(full_wire):
+            reports.append({field: doc[field] for field in OBSERVATION_FIELDS})
+        return ujson.dumps(reports).encode()
+
+    def projected() -> bytes:
+        return ujson.dumps(bson.decode_all(projected_wire)).encode()
+
+    before = measure("full docs + rebuild + ujson", legacy, rows)
+    after = measure("projection + ujson", projected, rows)
+    print(f"speed-up: {before / after:.1f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000)
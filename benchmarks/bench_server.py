@@ -0,0 +1,64 @@
+"""Throughput of a running API server under a fixed number of concurrent clients.
+
+Compares the run modes of main.py by running it once against each of them, with the same Mongo and Redis:
+
+    RUN_MODE=development DEBUG=1 python main.py      # single worker, debug and access log on
+    RUN_MODE=production python main.py              # a worker per CPU on a shared socket, no debug or access log
+
+    python -m benchmarks.bench_server [url] [concurrency] [seconds]
+
+The default url is a cached /id query, so the run measures the server rather than Mongo.
+"""
+import asyncio
+import sys
+import time
+
+import aiohttp
+
+URL = "http://127.0.0.1:8000/id?icao=KORD&start=1664582400&end=1664668800"
+
+
+async def client(session: aiohttp.ClientSession, url: str, deadline: float, latencies: list[float]) -> int:
+    errors = 0
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            async with session.get(url) as response:
+                await response.read()
+                if response.status != 200:
+                    errors += 1
+        except aiohttp.ClientError:
+            errors += 1
+        latencies.append(time.perf_counter() - started)
+    return errors
+
+
+def percentile(latencies: list[float], p: float) -> float:
+    return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+
+
+async def run(url: str, concurrency: int, seconds: float) -> None:
+    latencies: list[float] = []
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        # One request first, so that a cold cache does not count against the run
+        async with session.get(url) as response:
+            await response.read()
+        started = time.perf_counter()
+        deadline = started + seconds
+        errors = sum(await asyncio.gather(*(client(session, url, deadline, latencies) for _ in range(concurrency))))
+        elapsed = time.perf_counter() - started
+    latencies.sort()
+    print(f"{len(latencies)} requests in {elapsed:.1f} s, {errors} errors")
+    print(f"throughput: {len(latencies) / elapsed:.0f} req/s")
+    print(f"latency: p50 {percentile(latencies, 0.5) * 1e3:.1f} ms, p99 {percentile(latencies, 0.99) * 1e3:.1f} ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(
+        run(
+            sys.argv[1] if len(sys.argv) > 1 else URL,
+            int(sys.argv[2]) if len(sys.argv) > 2 else 64,
+            float(sys.argv[3]) if len(sys.argv) > 3 else 30,
+        )
+    )
@@ -3,13 +3,18 @@ from sanic import Sanic  # type: ignore
 from sanic.exceptions import InvalidUsage, MethodNotSupported, NotFound, ServerError  # type: ignore
 from sanic_ext import Extend  # type: ignore
 
-from app.api.routes.events import IDEvents, GeoEvents
+from app.api.routes.admin import ProfileRoute, ProfilesRoute
+from app.api.routes.aggregates import GeoAggregate, IDAggregate
+from app.api.routes.events import IDBatchEvents, IDEvents, GeoEvents
 from app.api.blueprints import api_blueprints
-from app.api.middlewares.on_request import validate_request
-from app.api.middlewares.on_response import send_metrics
+from app.api.middlewares.on_complete import release_abandoned_request
+from app.api.middlewares.on_request import start_profiling, track_request, validate_request
+from app.api.middlewares.on_response import finish_profiling, send_metrics
 from app.api.middlewares.on_start import create_app_context
+from app.api.middlewares.on_stop import close_app_context
 from app.api.routes.base_view import BaseView
 from app.api.routes.index import IndexRoute
+from app.api.routes.metrics import MetricsRoute
 from app.cfg import config
 
 
@@ -26,13 +31,24 @@ def create_app(*, api_config: object = config.APIConfig, log_config: dict = conf
     Extend(app)
 
     app.listener(create_app_context, "before_server_start")
+    app.listener(close_app_context, "after_server_stop")
+    app.middleware(track_request, "request")
+    app.middleware(start_profiling, "request")
     app.middleware(validate_request, "request")
     app.middleware(send_metrics, "response")
+    app.middleware(finish_profiling, "response")
+    app.add_signal(release_abandoned_request, "http.lifecycle.complete")
 
     app.blueprint(api_blueprints)
     app.add_route(IndexRoute.as_view(), "/", name="index")
+    app.add_route(MetricsRoute.as_view(), "/metrics", name="metrics")
+    app.add_route(ProfilesRoute.as_view(), "/admin/profiles", name="profiles")
+    app.add_route(ProfileRoute.as_view(), "/admin/profiles/<name:str>", name="profile")
     app.add_route(IDEvents.as_view(), "/id", name="id")
+    app.add_route(IDBatchEvents.as_view(), "/id/batch", name="id_batch")
     app.add_route(GeoEvents.as_view(), "/geo", name="geo")
+    app.add_route(IDAggregate.as_view(), "/id/aggregate", name="id_aggregate")
+    app.add_route(GeoAggregate.as_view(), "/geo/aggregate", name="geo_aggregate")
 
     app.error_handler.add(NotFound, BaseView.not_found)
     app.error_handler.add(InvalidUsage, BaseView.bad_request)
@@ -46,4 +62,4 @@ def create_app(*, api_config: object = config.APIConfig, log_config: dict = conf
 
 if __name__ == "__main__":
     api = create_app()
-    api.run(host="0.0.0.0")
+    api.run(**config.server.run_options())
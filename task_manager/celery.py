@@ -11,4 +11,5 @@ app.conf.beat_schedule = {
         "task": "task_manager.tasks.get_weather_data",
         "schedule": 1800.0,  # 30 minutes in seconds 1800
     },
+    "update_rollups": {"task": "task_manager.tasks.update_rollups", "schedule": 86400.0},  # one day in seconds
 }
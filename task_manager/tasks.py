@@ -1,34 +1,115 @@
+from celery.signals import worker_ready  # type: ignore
+
 from .celery import app
-from app.storage.mongo_client import get_db
+from app.cfg import config
+from app.cache.cache import get_cache_instance
+from app.storage.indexes import ensure_indexes
+from app.storage.migrations import rebuild_rollups
+from app.storage.mongo_client import DB, close_mongo_clients, get_db
 from app.service.get_data.process_data import ProcessStationData, ProcessStationsText, get_stations_to_parse
+from app.service.rollups import mark_rollups_ingested, rollup_cutoff
+from app.service.spatial import CATALOG_VERSION_KEY, StationIndex, load_station_index
+from app.service.storage_service import StorageService
 from app.service.get_data.collect import CollectWeatherData, CollectData
 import asyncio
-import os
+import logging
+import time
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+async def bootstrap_indexes() -> None:
+    """Ensure the indexes of the collections the tasks write to"""
+    await ensure_indexes(get_db(config.mongo.collection_icao), get_db(config.mongo.collection_weather_data))
 
 
-async def upload_icao():
-    """To request stations.txt, process and add to database"""
-    db_icao = get_db(collection=os.getenv("MONGO_DATABASE", "icao"))
+@worker_ready.connect
+def on_worker_ready(**kwargs: object) -> None:
+    """Wrapper to launch async function"""
+    asyncio.run(bootstrap_indexes())
+    # The pool must not outlive the bootstrap in the parent process, forked task processes open their own
+    close_mongo_clients()
+
+
+async def upload_icao() -> Optional[Dict[str, int]]:
+    """To request stations.txt, process and sync the station catalog"""
+    db_icao = get_db(collection=config.mongo.collection_icao)
+    db_meta = get_db(collection=config.mongo.collection_meta)
     process = ProcessStationsText(db_icao)
-    collect_data = CollectData(process, db_icao)
-    await collect_data.get_stations_txt()
+    collect_data = CollectData(process, db_meta)
+    counts = await collect_data.get_stations_txt()
+    if counts is None:
+        logger.info("Station catalog is up to date, stations.txt not modified")
+        return None
+    logger.info(
+        f"Station catalog synced: {counts['added']} added, {counts['changed']} changed, {counts['removed']} removed"
+    )
+    if any(counts.values()):
+        await db_meta.set_document(CATALOG_VERSION_KEY, {"updated_at": time.time()})
+    return counts
 
 
 @app.task
-def get_icao() -> None:
+def get_icao() -> Optional[Dict[str, int]]:
     """Wrapper to launch async function"""
-    asyncio.run(upload_icao())
+    return asyncio.run(upload_icao())
 
 
 async def upload_weather_data() -> None:
-    """To request weather data, process and upload to database"""
-    db_weather_data = get_db(collection=os.getenv("MONGO_DATABASE", "weather_data"))
+    """To request weather data newer than the station watermarks, process and upload to database"""
+    db_weather_data = get_db(collection=config.mongo.collection_weather_data)
+    db_watermarks = get_db(collection=config.mongo.collection_watermarks)
     station = ProcessStationData(storage=db_weather_data)
-    collect_weather_data = CollectWeatherData(station, db_weather_data)
-    await asyncio.gather(*(collect_weather_data.get_station_data(item) for item in await get_stations_to_parse()))
+    # Reports dated from now on are added to the rollups by this run or a later one
+    await mark_rollups_ingested(get_db(collection=config.mongo.collection_meta), int(time.time()))
+    changes: Dict[str, tuple[int, int]] = {}
+    async with CollectWeatherData(station) as collect_weather_data:
+        listing = await collect_weather_data.get_station_listing()
+        watermarks = await db_watermarks.watermarks_get()
+        stations = get_stations_to_parse(listing, watermarks, since=int(time.time()) - config.collector.lookback)
+        logger.info(f"{len(stations)} of {len(listing)} stations have new reports")
+        async for batch in collect_weather_data.iter_batches(stations):
+            inserted = await db_weather_data.timestamps_bulk_upload(batch)
+            # Every report of the batch, so that the reports stored by a run that failed before this are added too
+            await db_weather_data.rollups_update(batch, rollup_cutoff())
+            await db_watermarks.watermarks_update({item.icao: listing[item.icao] for item in batch})
+            for item in inserted:
+                first, last = changes.get(item.icao, (item.date, item.date))
+                changes[item.icao] = (min(first, item.date), max(last, item.date))
+    logger.info(f"New reports of {len(changes)} stations stored")
+    if changes:
+        await refresh_cache(db_weather_data, changes)
+
+
+async def refresh_cache(db_weather_data: DB, changes: Dict[str, tuple[int, int]]) -> None:
+    """Invalidate the cached queries the new reports change and warm the most popular of them"""
+    cache = get_cache_instance()
+    try:
+        invalidated = await cache.invalidate(changes)
+        popular = await cache.most_popular(invalidated, config.redis.prewarm)
+        stations = StationIndex()
+        await load_station_index(stations, get_db(config.mongo.collection_icao), get_db(config.mongo.collection_meta))
+        service = StorageService(storage=db_weather_data, cache=cache, stations=stations)
+        warmed = await service.warm(popular)
+        logger.info(f"{len(invalidated)} cached queries invalidated, {warmed} warmed")
+    finally:
+        await cache.redis_client.close()
 
 
 @app.task
 def get_weather_data() -> None:
     """Wrapper to launch async function"""
     asyncio.run(upload_weather_data())
+
+
+async def rebuild_settled_rollups() -> None:
+    """Recompute the rollup buckets of the reports that settled since the last rebuild"""
+    db_weather_data = get_db(collection=config.mongo.collection_weather_data)
+    await rebuild_rollups(db_weather_data, get_db(collection=config.mongo.collection_meta), full=False)
+
+
+@app.task
+def update_rollups() -> None:
+    """Wrapper to launch async function"""
+    asyncio.run(rebuild_settled_rollups())
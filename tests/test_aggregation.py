@@ -0,0 +1,81 @@
+from app.service.aggregation import choose_rollup, merge_partials
+from app.service.rollups import RollupCoverage
+
+HOUR = 3600
+DAY = 86400
+
+
+def partial(icao: str, bucket: int, count: int, n: int, total: float, low, high) -> dict:
+    temperature = {"n": n, "sum": total, "min": low, "max": high}
+    return {"icao": icao, "bucket": bucket, "count": count, "temperature": temperature}
+
+
+def test_choose_rollup_prefers_the_coarsest_dividing_granularity():
+    assert choose_rollup(DAY, 0, 2 * DAY - 1, [HOUR, DAY]) == DAY
+    assert choose_rollup(6 * HOUR, 0, DAY - 1, [HOUR, DAY]) == HOUR
+
+
+def test_choose_rollup_needs_a_whole_bucket_in_range():
+    assert choose_rollup(DAY, HOUR, DAY + HOUR, [DAY]) is None
+    assert choose_rollup(DAY, HOUR, DAY + HOUR, [HOUR, DAY]) == HOUR
+    assert choose_rollup(90, 0, DAY, [HOUR, DAY]) is None
+
+
+def test_merge_partials_combines_buckets_per_station():
+    merged = merge_partials(
+        [
+            partial("KJFK", HOUR, 2, 2, 30, 10, 20),
+            partial("EGLL", 0, 1, 1, 5, 5, 5),
+            partial("KJFK", 0, 3, 2, 10, 4, 6),
+        ],
+        DAY,
+        ["temperature"],
+    )
+    assert merged == [
+        {"icao": "EGLL", "bucket": 0, "count": 1, "temperature": {"n": 1, "sum": 5, "min": 5, "max": 5}},
+        {"icao": "KJFK", "bucket": 0, "count": 5, "temperature": {"n": 4, "sum": 40, "min": 4, "max": 20}},
+    ]
+
+
+def test_merge_partials_ignores_missing_extremes():
+    merged = merge_partials(
+        [partial("KJFK", 0, 1, 0, 0, None, None), partial("KJFK", HOUR, 1, 1, 7, 7, 7)], DAY, ["temperature"]
+    )
+    assert merged[0]["temperature"] == {"n": 1, "sum": 7, "min": 7, "max": 7}
+
+
+def test_coverage_without_markers_covers_nothing():
+    assert RollupCoverage().spans(0, 3 * DAY, DAY, 0) == [(0, 3 * DAY, False)]
+
+
+def test_coverage_splits_around_the_gap_between_rebuild_and_ingest():
+    coverage = RollupCoverage(rebuilt_until=DAY, ingested_from=2 * DAY + HOUR)
+    assert coverage.spans(0, 5 * DAY, DAY, 0) == [(0, DAY, True), (DAY, 3 * DAY, False), (3 * DAY, 5 * DAY, True)]
+    assert coverage.spans(0, 5 * DAY, HOUR, 0) == [
+        (0, DAY, True),
+        (DAY, 2 * DAY + HOUR, False),
+        (2 * DAY + HOUR, 5 * DAY, True),
+    ]
+
+
+def test_coverage_bounds_are_aligned_to_whole_buckets():
+    coverage = RollupCoverage(rebuilt_until=DAY + HOUR)
+    assert coverage.spans(0, 2 * DAY, DAY, 0) == [(0, DAY, True), (DAY, 2 * DAY, False)]
+    assert not coverage.covers(DAY, DAY, 0)
+    assert coverage.covers(DAY, HOUR, 0)
+
+
+def test_coverage_load_reads_the_meta_document():
+    coverage = RollupCoverage(rebuilt_until=DAY)
+    coverage.load({"ingested_from": 0})
+    assert (coverage.rebuilt_until, coverage.ingested_from) == (None, 0)
+    assert coverage.spans(DAY, 2 * DAY, DAY, 0) == [(DAY, 2 * DAY, True)]
+    coverage.load(None)
+    assert coverage.spans(DAY, 2 * DAY, DAY, 0) == [(DAY, 2 * DAY, False)]
+
+
+def test_coverage_leaves_settled_buckets_to_the_rebuild():
+    coverage = RollupCoverage(rebuilt_until=DAY, ingested_from=DAY)
+    assert coverage.spans(0, 5 * DAY, DAY, 3 * DAY) == [(0, DAY, True), (DAY, 3 * DAY, False), (3 * DAY, 5 * DAY, True)]
+    assert not coverage.covers(2 * DAY, DAY, 3 * DAY)
+    assert coverage.covers(3 * DAY, DAY, 3 * DAY)
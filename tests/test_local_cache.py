@@ -0,0 +1,31 @@
+import tracemalloc
+
+import ujson  # type: ignore
+
+from app.cache.local import LocalCache, rows_size
+
+
+def report(count: int) -> list[dict]:
+    row = {"icao": "KJFK", "temperature": 12.5, "pressure": 1013, "location": {"coordinates": [-73.78, 40.64]}}
+    return [dict(row, date=1000 + i) for i in range(count)]
+
+
+def test_rows_size_is_close_to_the_decoded_memory():
+    encoded = ujson.dumps(report(1000))
+    tracemalloc.start()
+    try:
+        decoded = ujson.loads(encoded)
+        used = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    assert 0.8 * used <= rows_size(decoded) <= 1.25 * used
+    assert rows_size(decoded) > len(encoded)
+
+
+def test_local_cache_evicts_by_size():
+    cache = LocalCache(max_bytes=rows_size(report(10)) * 2, ttl=60)
+    for key in "abc":
+        cache.set(key, report(10), rows_size(report(10)))
+    assert cache.get("a") is None
+    assert cache.get("b") is not None and cache.get("c") is not None
+    assert cache.size <= cache.max_bytes
@@ -0,0 +1,69 @@
+import calendar
+
+import pytest
+
+from app.service.get_data.metar import parse_decoded_report, parse_decoded_reports
+from app.service.models import Observation
+
+REPORT = """Chicago O'Hare International Airport, IL, United States (KORD) 41-59N 087-54W 201M
+Oct 18, 2022 - 10:51 AM EDT / 2022.10.18 1451 UTC
+Wind: from the W (270 degrees) at 12 MPH (10 KT):0
+Visibility: 10 mile(s):0
+Sky conditions: clear
+Temperature: 55.9 F (13.3 C)
+Dew Point: 39.0 F (3.9 C)
+Relative Humidity: 52%
+Pressure (altimeter): 30.05 in. Hg (1017 hPa)
+ob: KORD 181451Z 27010KT 10SM CLR 13/04 A3005
+cycle: 15
+"""
+
+WINTER_REPORT = """Fairbanks International Airport, AK, United States (PAFA) 64-48N 147-52W 138M
+Jan 05, 2023 - 11:53 PM AKST / 2023.01.06 0853 UTC
+Wind: Calm:0
+Temperature: -22.0 F (-30.0 C)
+Pressure (altimeter): 30.42 in. Hg (1030 hPa)
+"""
+
+SPARSE_REPORT = """Nowhere Field (XXXX)
+Oct 18, 2022 - 02:00 AM UTC / 2022.10.18 0200 UTC
+Visibility: 10 mile(s):0
+"""
+
+
+def test_parse_report():
+    assert parse_decoded_report(REPORT, "KORD") == Observation(
+        "KORD", calendar.timegm((2022, 10, 18, 14, 51, 0)), 13.3, 1017, 270, 10
+    )
+
+
+def test_date_is_the_utc_time():
+    # The local time on the same line is four hours behind and must not be used
+    assert parse_decoded_report(REPORT, "KORD").date == 1666104660
+
+
+def test_negative_temperature():
+    observation = parse_decoded_report(WINTER_REPORT, "PAFA")
+    assert observation.temperature == -30.0
+    assert observation.date == calendar.timegm((2023, 1, 6, 8, 53, 0))
+
+
+def test_calm_wind_has_no_direction():
+    observation = parse_decoded_report(WINTER_REPORT, "PAFA")
+    assert observation.wind_speed == 0
+    assert observation.wind_direction is None
+
+
+def test_missing_fields_are_none():
+    assert parse_decoded_report(SPARSE_REPORT, "XXXX") == Observation("XXXX", calendar.timegm((2022, 10, 18, 2, 0, 0)))
+
+
+@pytest.mark.parametrize("report", ["", "Nowhere Field (XXXX)", "Nowhere Field (XXXX)\nOct 18, 2022 - 02:00 AM\n"])
+def test_report_without_time_is_rejected(report):
+    with pytest.raises(ValueError):
+        parse_decoded_report(report, "XXXX")
+
+
+def test_malformed_reports_are_skipped():
+    observations = parse_decoded_reports([("KORD", REPORT), ("XXXX", "Nowhere Field (XXXX)"), ("PAFA", WINTER_REPORT)])
+    assert [observation.icao for observation in observations] == ["KORD", "PAFA"]
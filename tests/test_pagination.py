@@ -0,0 +1,30 @@
+import pytest
+
+from app.service.pagination import decode_cursor, encode_cursor, paginate
+
+
+def rows(count: int) -> list[dict]:
+    return [{"date": 1000 + i, "icao": f"K{i:03d}"} for i in range(count)]
+
+
+def test_paginate_last_page_has_no_cursor():
+    page = paginate(rows(3), 3)
+    assert page.rows == rows(3)
+    assert page.next_cursor is None
+
+
+def test_paginate_cursor_points_after_the_last_row():
+    page = paginate(rows(4), 3)
+    assert page.rows == rows(3)
+    assert page.next_cursor is not None
+    assert decode_cursor(page.next_cursor) == (1002, "K002")
+
+
+def test_decode_cursor_round_trip():
+    assert decode_cursor(encode_cursor({"date": 5, "icao": "EGLL"})) == (5, "EGLL")
+
+
+@pytest.mark.parametrize("token", ["", "not base64!", "WzEsMl0=", "eyJhIjoxfQ==", "WyJ4IiwiRUdMTCJd"])
+def test_decode_cursor_rejects_malformed_tokens(token):
+    with pytest.raises(ValueError):
+        decode_cursor(token)
@@ -0,0 +1,33 @@
+import pytest
+
+from app.service.get_data.process_data import ProcessStationsText
+
+ADAK = "AK ADAK NAS         PADK  ADK   70454  51 53N  176 39W    4   X     T          7 US"
+
+
+def test_parse_station_line():
+    assert ProcessStationsText.parse_station_line(ADAK) == {
+        "icao": "PADK",
+        "location": {"type": "Point", "coordinates": [-176.65, 51.883333]},
+    }
+
+
+def test_southern_and_eastern_hemispheres():
+    line = ADAK[:44] + "S" + ADAK[45:53] + "E" + ADAK[54:]
+    assert ProcessStationsText.parse_station_line(line)["location"]["coordinates"] == [176.65, -51.883333]
+
+
+@pytest.mark.parametrize(
+    "line",
+    [
+        "",
+        "! Stations of Alaska",
+        "CD  STATION         ICAO  IATA  SYNOP   LAT     LONG   ELEV   M  N  V  U  A  C",
+        "AK ADAK NAS                 ADK   70454  51 53N  176 39W    4   X     T          7 US",
+        ADAK[:44],
+        ADAK[:53],
+        ADAK[:47] + "1x6" + ADAK[50:],
+    ],
+)
+def test_unparseable_lines_are_skipped(line):
+    assert ProcessStationsText.parse_station_line(line) is None
@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+from aiohttp import ClientConnectionError
+
+from app.service.get_data.retry import CircuitBreaker, CircuitOpen, RetryPolicy
+
+
+def policy(max_attempts: int = 3, base_delay: float = 0, max_delay: float = 0) -> RetryPolicy:
+    return RetryPolicy(max_attempts, base_delay, max_delay, attempt_timeout=1, deadline=5)
+
+
+class Flaky(object):
+    """Fails with each of errors in turn, then returns result"""
+
+    def __init__(self, *errors: BaseException, result: str = "ok") -> None:
+        self.errors = list(errors)
+        self.result = result
+        self.calls = 0
+
+    async def __call__(self) -> str:
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return self.result
+
+
+def test_retry_until_success():
+    func = Flaky(ClientConnectionError(), asyncio.TimeoutError())
+    assert asyncio.run(policy().call(func)) == "ok"
+    assert func.calls == 3
+
+
+def test_retry_gives_up_after_max_attempts():
+    func = Flaky(*[ClientConnectionError() for _ in range(3)])
+    with pytest.raises(ClientConnectionError):
+        asyncio.run(policy().call(func))
+    assert func.calls == 3
+
+
+def test_retry_does_not_retry_other_errors():
+    func = Flaky(KeyError("icao"))
+    with pytest.raises(KeyError):
+        asyncio.run(policy().call(func))
+    assert func.calls == 1
+
+
+def test_backoff_is_capped():
+    retry = policy(base_delay=1, max_delay=4)
+    assert all(0 <= retry.backoff(attempt) <= 4 for attempt in range(10))
+
+
+def test_breaker_opens_after_threshold_and_rejects_calls():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    func = Flaky(*[ClientConnectionError() for _ in range(2)])
+    with pytest.raises(ClientConnectionError):
+        asyncio.run(policy(max_attempts=2).call(func, breaker))
+    with pytest.raises(CircuitOpen):
+        asyncio.run(policy().call(Flaky(), breaker))
+
+
+def test_breaker_lets_one_trial_through_after_reset_timeout():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    breaker.before_call()
+    with pytest.raises(CircuitOpen):
+        breaker.before_call()
+    breaker.record_success()
+    breaker.before_call()
+    assert breaker.opened_at is None
+
+
+def test_breaker_reopens_when_the_trial_fails():
+    breaker = CircuitBreaker(failure_threshold=5, reset_timeout=0)
+    for _ in range(5):
+        breaker.record_failure()
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.opened_at is not None
+    assert breaker.failures == 6
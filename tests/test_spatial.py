@@ -0,0 +1,41 @@
+import pytest
+
+from app.service.spatial import StationIndex
+
+
+def station(icao: str, lat: float, lon: float) -> dict:
+    return {"icao": icao, "location": {"type": "Point", "coordinates": [lon, lat]}}
+
+
+@pytest.fixture
+def index() -> StationIndex:
+    index = StationIndex()
+    index.load(
+        [
+            station("KJFK", 40.64, -73.78),
+            station("KLGA", 40.78, -73.87),
+            station("KEWR", 40.69, -74.17),
+            station("EGLL", 51.47, -0.45),
+            station("NZAA", -37.01, 174.79),
+            station("PADK", 51.88, -176.65),
+        ]
+    )
+    return index
+
+
+def test_within_is_ordered_nearest_first(index):
+    assert index.within(40.64, -73.78, 40_000) == ["KJFK", "KLGA", "KEWR"]
+    assert index.within(40.64, -73.78, 10_000) == ["KJFK"]
+
+
+def test_within_spans_the_antimeridian(index):
+    assert index.within(51.9, 179.9, 300_000) == ["PADK"]
+
+
+def test_within_whole_earth(index):
+    assert sorted(index.within(0, 0, 30_000_000)) == ["EGLL", "KEWR", "KJFK", "KLGA", "NZAA", "PADK"]
+
+
+def test_within_requires_a_loaded_index():
+    with pytest.raises(RuntimeError):
+        StationIndex().within(0, 0, 1000)